@@ -1,12 +1,50 @@
 import zipfile
 import os
+import sys
 import shutil
 from pathlib import Path
 import tempfile
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+# リポジトリ直下の ziputil を使う
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from ziputil import (  # noqa: E402
+    check_compresslevel,
+    compress_file,
+    prefetch,
+    safe_member_path,
+    write_raw_member,
+)
+
+# ZIPのUTF-8フラグとデータディスクリプタフラグ
+FLAG_UTF8 = 0x800
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_ENCRYPTED = 0x01
+
+# 拡張フィールドのID（Zip64 と Info-ZIP Unicode Path）
+EXTRA_ZIP64 = 0x0001
+EXTRA_UNICODE_PATH = 0x7075
+
+# 自動判定で試すエンコーディング（先に一致したものを採用）
+CANDIDATE_ENCODINGS = ("utf-8", "cp932")
+
+
+def _extract(zip_ref, file_info, extract_path):
+    # zlib は展開中に GIL を解放するため、メンバーごとに並列で展開できる
+    extract_path.parent.mkdir(parents=True, exist_ok=True)
+    with zip_ref.open(file_info) as source, open(extract_path, "wb") as target:
+        shutil.copyfileobj(source, target)
 
 
 def reencode_zip(
-    input_zip_path, output_zip_path, input_encoding="cp932", output_encoding="utf-8"
+    input_zip_path,
+    output_zip_path,
+    input_encoding="cp932",
+    output_encoding="utf-8",
+    compression=zipfile.ZIP_DEFLATED,
+    compresslevel=None,
+    workers=None,
 ):
     """
     ZIPファイルを解凍し、指定されたエンコーディングで再圧縮します。
@@ -16,7 +54,12 @@ def reencode_zip(
         output_zip_path (str): 出力ZIPファイルのパス
         input_encoding (str): 入力ZIPファイルのエンコーディング（デフォルト: cp932）
         output_encoding (str): 出力ZIPファイルのエンコーディング（デフォルト: utf-8）
+        compression (int): 出力ZIPの圧縮方式（ZIP_STORED, ZIP_DEFLATED, ZIP_LZMA など）
+        compresslevel (int): 圧縮レベル（デフォルト: 圧縮方式の既定値）
+        workers (int): 展開と圧縮に使うスレッド数（デフォルト: CPU数に応じて自動）
     """
+    check_compresslevel(compression, compresslevel)
+
     # 一時ディレクトリの作成
     temp_dir = Path(tempfile.mkdtemp())
     if temp_dir.exists():
@@ -24,55 +67,204 @@ def reencode_zip(
     temp_dir.mkdir()
 
     try:
-        # 入力ZIPファイルを解凍
-        with zipfile.ZipFile(input_zip_path, "r") as zip_ref:
-            # ファイル名のエンコーディングを指定して解凍
-            for file_info in zip_ref.filelist:
-                # ファイル名をデコード
-                filename = file_info.filename.encode(input_encoding).decode(output_encoding)
-                if filename.endswith("/"):
-                    # ディレクトリの場合はスキップ
-                    continue
-                # 解凍先のパスを作成
-                extract_path = temp_dir / filename
-                # 必要なディレクトリを作成
-                extract_path.parent.mkdir(parents=True, exist_ok=True)
-
-                # ファイルを解凍
-                with zip_ref.open(file_info) as source, open(
-                    extract_path, "wb"
-                ) as target:
-                    shutil.copyfileobj(source, target)
-
-        # 新しいZIPファイルを作成
-        with zipfile.ZipFile(output_zip_path, "w", zipfile.ZIP_DEFLATED) as zip_ref:
-            # 全てのファイルを再圧縮
-            for file_path in temp_dir.rglob("*"):
-                if file_path.is_file():
-                    # 相対パスを計算
-                    arcname = str(file_path.relative_to(temp_dir))
-                    # 新しいエンコーディングでファイル名を設定
-                    arcname = arcname
-                    # ファイルを圧縮
-                    zip_ref.write(file_path, arcname)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 入力ZIPファイルを解凍
+            with zipfile.ZipFile(input_zip_path, "r") as zip_ref:
+                # ファイル名のエンコーディングを指定して解凍
+                futures = []
+                for file_info in zip_ref.filelist:
+                    # ファイル名をデコード
+                    filename = file_info.filename.encode(input_encoding).decode(
+                        output_encoding
+                    )
+                    if filename.endswith("/"):
+                        # ディレクトリの場合はスキップ
+                        continue
+                    # 解凍先のパスを作成
+                    extract_path = safe_member_path(temp_dir, filename)
+                    # ファイルを解凍
+                    futures.append(
+                        executor.submit(_extract, zip_ref, file_info, extract_path)
+                    )
+                for future in futures:
+                    future.result()
+
+            # 新しいZIPファイルを作成
+            files = [p for p in temp_dir.rglob("*") if p.is_file()]
+            with zipfile.ZipFile(output_zip_path, "w") as zip_ref:
+                # 読み込みと圧縮はスレッドで並列に行い、圧縮済みのデータを順番に書き込む
+                compressed = prefetch(
+                    executor,
+                    lambda file_path: compress_file(
+                        file_path,
+                        # 相対パスを計算
+                        str(file_path.relative_to(temp_dir)),
+                        compression,
+                        compresslevel,
+                    ),
+                    files,
+                )
+                for _, (zinfo, data) in compressed:
+                    write_raw_member(zip_ref, zinfo, [data])
 
     finally:
         # 一時ディレクトリの削除
         shutil.rmtree(temp_dir)
 
 
+def iter_extra_fields(extra):
+    """拡張フィールドを (ID, データ) の組に分ける"""
+    offset = 0
+    while offset + 4 <= len(extra):
+        field_id, size = struct.unpack("<HH", extra[offset : offset + 4])
+        yield field_id, extra[offset + 4 : offset + 4 + size]
+        offset += 4 + size
+
+
+def strip_extra_fields(extra, field_ids):
+    """指定したIDの拡張フィールドを取り除く"""
+    return b"".join(
+        struct.pack("<HH", field_id, len(data)) + data
+        for field_id, data in iter_extra_fields(extra)
+        if field_id not in field_ids
+    )
+
+
+def unicode_path(file_info):
+    """Info-ZIP Unicode Path 拡張フィールドの名前を返す（ないか古ければ None）"""
+    raw = file_info.orig_filename.encode("cp437", errors="replace")
+    for field_id, data in iter_extra_fields(file_info.extra):
+        if field_id != EXTRA_UNICODE_PATH or len(data) < 5 or data[0] != 1:
+            continue
+        # ヘッダの名前のCRCが一致しない場合、名前を変えたツールが更新し忘れている
+        (name_crc,) = struct.unpack("<L", data[1:5])
+        if name_crc == zipfile.crc32(raw):
+            try:
+                return data[5:].decode("utf-8")
+            except UnicodeDecodeError:
+                return None
+    return None
+
+
+def guess_filename(file_info, candidate_encodings=CANDIDATE_ENCODINGS):
+    """
+    文字化けしたメンバー名を元のエンコーディングで読み直します。
+
+    UTF-8フラグのないメンバー名は zipfile が cp437 としてデコードしているので、
+    元のバイト列に戻してから候補のエンコーディングで順に読み直します。
+    Info-ZIP Unicode Path 拡張フィールドがあれば、その名前を優先します。
+
+    Args:
+        file_info (zipfile.ZipInfo): 入力ZIPのメンバー情報
+        candidate_encodings (tuple): 試すエンコーディング（デフォルト: utf-8, cp932）
+
+    Returns:
+        str: 読み直したメンバー名（どれにも一致しなければ元の名前）
+    """
+    if file_info.flag_bits & FLAG_UTF8:
+        return file_info.filename
+    filename = unicode_path(file_info)
+    if filename is not None:
+        return filename
+    raw = file_info.filename.encode("cp437")
+    for encoding in candidate_encodings:
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return file_info.filename
+
+
+def _read_raw(source_fp, file_info):
+    remaining = file_info.compress_size
+    while remaining > 0:
+        chunk = source_fp.read(min(remaining, 1 << 20))
+        if not chunk:
+            raise EOFError(f"ZIPファイルが途中で終わっています: {file_info.filename}")
+        yield chunk
+        remaining -= len(chunk)
+
+
+def _copy_raw_member(source_fp, zip_out, file_info, filename):
+    # 圧縮済みのデータをそのままコピーし、ローカルヘッダだけを新しい名前で書き直す
+    if file_info.flag_bits & FLAG_ENCRYPTED:
+        raise ValueError(f"暗号化されたメンバーには対応していません: {filename}")
+
+    # ローカルヘッダの名前と拡張フィールドの長さはセントラルディレクトリと異なることがあるので、
+    # zipfile と同じ structFileHeader で読んで圧縮データの位置を求める
+    source_fp.seek(file_info.header_offset)
+    header = struct.unpack(
+        zipfile.structFileHeader, source_fp.read(zipfile.sizeFileHeader)
+    )
+    name_length, extra_length = header[-2:]
+    source_fp.seek(name_length + extra_length, os.SEEK_CUR)
+
+    new_info = zipfile.ZipInfo(filename, date_time=file_info.date_time)
+    new_info.compress_type = file_info.compress_type
+    new_info.CRC = file_info.CRC
+    new_info.compress_size = file_info.compress_size
+    new_info.file_size = file_info.file_size
+    new_info.create_system = file_info.create_system
+    new_info.create_version = file_info.create_version
+    new_info.extract_version = file_info.extract_version
+    new_info.internal_attr = file_info.internal_attr
+    new_info.external_attr = file_info.external_attr
+    new_info.comment = file_info.comment
+    # Zip64 フィールドは必要に応じて FileHeader が付け直すので、それ以外をコピーする
+    new_info.extra = strip_extra_fields(file_info.extra, {EXTRA_ZIP64})
+    # サイズとCRCはヘッダに書くので、データディスクリプタは付けない
+    new_info.flag_bits = file_info.flag_bits & ~(FLAG_UTF8 | FLAG_DATA_DESCRIPTOR)
+
+    # 同じ名前に変換されたメンバーがあれば write_raw_member が ValueError を送出する
+    write_raw_member(zip_out, new_info, _read_raw(source_fp, file_info))
+
+
+def stream_reencode_zip(
+    input_zip_path, output_zip_path, candidate_encodings=CANDIDATE_ENCODINGS
+):
+    """
+    ZIPファイルを展開・再圧縮せずに、メンバー名のエンコーディングだけを直します。
+
+    各メンバーの圧縮データをそのまま出力ZIPへコピーするため、一時ディレクトリを使わず、
+    再圧縮のコストもかかりません。メンバー名は guess_filename で自動判定します。
+
+    Args:
+        input_zip_path (str): 入力ZIPファイルのパス
+        output_zip_path (str): 出力ZIPファイルのパス
+        candidate_encodings (tuple): 試すエンコーディング（デフォルト: utf-8, cp932）
+
+    Returns:
+        int: 名前を変更したメンバー数
+    """
+    renamed = 0
+    # 途中で失敗したときに書きかけのZIPを残さないよう、一時ファイルに書いてからリネームする
+    output_zip_path = Path(output_zip_path)
+    tmp_path = output_zip_path.with_name(f".{output_zip_path.name}.tmp")
+    try:
+        with zipfile.ZipFile(input_zip_path, "r") as zip_in, open(
+            input_zip_path, "rb"
+        ) as source_fp, zipfile.ZipFile(tmp_path, "w") as zip_out:
+            for file_info in zip_in.infolist():
+                filename = guess_filename(file_info, candidate_encodings)
+                if filename != file_info.filename:
+                    renamed += 1
+                _copy_raw_member(source_fp, zip_out, file_info, filename)
+        os.replace(tmp_path, output_zip_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return renamed
+
+
 def main():
     # 使用例
     input_zip = "./backups/slackdump_20240821_000000.zip"  # 入力ZIPファイル
     output_zip = "output.zip"  # 出力ZIPファイル
 
-    # Windows環境で作成されたZIPファイルをUTF-8に変換する例
-    reencode_zip(
-        input_zip,
-        output_zip,
-        input_encoding="cp437",  # Windowsの日本語環境でよく使用される
-        output_encoding="utf-8",  # 出力をUTF-8に
-    )
+    # Windows環境で作成されたZIPファイルのメンバー名をUTF-8に変換する例
+    # （cp932 などの文字化けは自動判定し、圧縮データはそのままコピーします）
+    renamed = stream_reencode_zip(input_zip, output_zip)
+    print(f"{renamed} 個のメンバー名を変換しました")
 
 
 if __name__ == "__main__":
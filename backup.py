@@ -1,16 +1,43 @@
 import os
+import re
 import subprocess
 import sys
 import shutil
 from pathlib import Path
-from datetime import datetime
+from datetime import date, datetime, timedelta
 import zipfile
 import tempfile
 import argparse
+import time
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from tqdm import tqdm
 
-from mod_text import collect_and_process_html_files, analyze_consolidate_and_clean_files
+from mod_text import (
+    collect_and_process_html_files,
+    analyze_consolidate_and_clean_files,
+    make_partitioner,
+)
+from combine import SIZE_METRICS
+from snapshots import list_merge_sources, merge_day_file
+from watch import SnapshotWatcher, watch
+from channel_index import (
+    load_channel_index,
+    parse_day_file,
+    print_channel_index,
+    select_channels,
+)
 from dump2html import SlackJsonToHtml
+from journal import RunJournal
+from ziputil import (
+    ZIP_CODECS,
+    check_compresslevel,
+    compress_file,
+    prefetch,
+    safe_member_path,
+    write_raw_member,
+)
+
 
 def get_credentials():
     print("Slackトークンとクッキーを入力してください")
@@ -34,13 +61,34 @@ def get_backup_path(backup_id: str):
     return backup_dir
 
 
+def get_work_path(backup_id: str):
+    # バックアップIDごとに slackdump / html / txt の作業ディレクトリを分ける
+    # （default は従来どおりカレントディレクトリの ./slackdump, ./html, ./txt を使う）
+    work_dir = Path(".") if backup_id == "default" else Path("work") / backup_id
+    for name in ("slackdump", "html", "txt"):
+        (work_dir / name).mkdir(parents=True, exist_ok=True)
+    return work_dir
+
+
+def atomic_copy(src_path, dst_path: Path):
+    # 書きかけのZIPがマージや監視モードで読まれないよう、同じディレクトリの一時ファイルに
+    # コピーしてからリネームする
+    tmp_path = dst_path.with_name(f".{dst_path.name}.tmp")
+    try:
+        shutil.copy2(src_path, tmp_path)
+        os.replace(tmp_path, dst_path)
+    except BaseException:
+        tmp_path.unlink(missing_ok=True)
+        raise
+    return dst_path
+
+
 def archive_with_timestamp(src_zip, backup_id: str):
     timestamp = get_timestamp()
     backup_path = get_backup_path(backup_id)
     new_name = f"slackdump_{timestamp}.zip"
     dst_path = backup_path / new_name
-    shutil.copy2(src_zip, dst_path)
-    return dst_path
+    return atomic_copy(src_zip, dst_path)
 
 
 def parse_args():
@@ -65,47 +113,218 @@ def parse_args():
         action="store_true",
         help="Skip analyzing and cleaning text files",
     )
+    parser.add_argument(
+        "--compact-text",
+        action="store_true",
+        help="Render threads compactly (date once per thread, relative times, merged posts)",
+    )
+    parser.add_argument(
+        "--size-metric",
+        choices=sorted(SIZE_METRICS),
+        default="characters",
+        help="Unit used for the per-file size limit (default: characters)",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        default=100_0000,
+        help="Maximum size of each text file in --size-metric units (default: 1000000)",
+    )
+    parser.add_argument(
+        "--since",
+        type=date.fromisoformat,
+        default=None,
+        help="Only render day files on or after this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--until",
+        type=date.fromisoformat,
+        default=None,
+        help="Only render day files on or before this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--zip-codec",
+        choices=sorted(ZIP_CODECS),
+        default="deflated",
+        help="Compression codec for merged archives (default: deflated)",
+    )
+    parser.add_argument(
+        "--zip-level",
+        type=int,
+        default=None,
+        help="Compression level for merged archives: deflated 0-9, bzip2 1-9 "
+        "(default: codec default)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of threads for zip extraction and compression",
+    )
+    parser.add_argument(
+        "--restart",
+        action="store_true",
+        help="Discard the run journal and start over instead of resuming",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and process new snapshots as they appear in backups/<id>/",
+    )
+    parser.add_argument(
+        "--interval",
+        type=float,
+        default=60,
+        help="Seconds between checks for new snapshots in --watch mode (default: 60)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=256,
+        help="Number of parsed day files kept in memory in --watch mode (default: 256)",
+    )
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        default=None,
+        help="Number of backup IDs to process concurrently (default: all)",
+    )
     parser.add_argument(
         "--backup-id",
         "-b",
-        default="default",
-        help="Backup namespace ID (default: default)",
+        dest="backup_ids",
+        nargs="+",
+        default=["default"],
+        help="Backup namespace IDs (default: default)",
     )
-    return parser.parse_args()
-
-
-def merge_zip_files(backup_id: str):
+    args = parser.parse_args()
+    if args.since and args.until and args.since > args.until:
+        parser.error("--since must be on or before --until")
+    # 圧縮レベルの誤りは、展開を終えてから失敗しないよう最初に確認する
+    try:
+        check_compresslevel(ZIP_CODECS[args.zip_codec], args.zip_level)
+    except ValueError as e:
+        parser.error(f"--zip-level: {e} (--zip-codec {args.zip_codec})")
+    return args
+
+
+def _extract_member(zf: zipfile.ZipFile, member: str, dest_dir: Path):
+    # ZipFile は展開中に GIL を解放するので、スレッドごとにメンバーを読み出せる
+    target_path = safe_member_path(dest_dir, member)
+    if member.endswith("/"):
+        target_path.mkdir(parents=True, exist_ok=True)
+        return
+    target_path.parent.mkdir(parents=True, exist_ok=True)
+    data = zf.read(member)
+    if parse_day_file(member) is not None and target_path.exists():
+        # 前のスナップショットにもある日別ファイルは、投稿単位でまとめる
+        data = merge_day_file(target_path.read_bytes(), data)
+    target_path.write_bytes(data)
+
+
+# 日別ファイルの JSON をパースせずに、返信が属するスレッドの先頭時刻を取り出す
+THREAD_TS_PATTERN = re.compile(rb'"thread_ts"\s*:\s*"(\d+(?:\.\d+)?)"')
+
+
+def select_window_members(zip_ref: zipfile.ZipFile, members, since, until):
+    """期間内の日別ファイルと、その返信のスレッド先頭がある日別ファイルだけを選ぶ
+
+    dump2html の parent_posts と同じく、スレッド先頭時刻の前後 1 日の日別ファイルを加える。
+    日別ファイル以外（users.json など）はすべて残す。
+    """
+
+    def in_window(day):
+        return (since is None or since <= day) and (until is None or day <= until)
+
+    day_files = {}  # (チャンネル名, 日付) -> メンバー名
+    for name in members:
+        day_file = parse_day_file(name)
+        if day_file is not None:
+            day_files[day_file[0], date.fromisoformat(day_file[1])] = name
+
+    selected = {name for (_, day), name in day_files.items() if in_window(day)}
+    parents = set()
+    for (channel, _), name in day_files.items():
+        if name not in selected:
+            continue
+        for thread_ts in THREAD_TS_PATTERN.findall(zip_ref.read(name)):
+            day = date.fromtimestamp(float(thread_ts))
+            for d in (day - timedelta(days=1), day, day + timedelta(days=1)):
+                if (channel, d) in day_files:
+                    parents.add(day_files[channel, d])
+
+    return [
+        name
+        for name in members
+        if parse_day_file(name) is None or name in selected or name in parents
+    ]
+
+
+def merge_zip_files(
+    backup_id: str,
+    compression: int = zipfile.ZIP_DEFLATED,
+    compresslevel: int | None = None,
+    workers: int | None = None,
+    executor: ThreadPoolExecutor | None = None,
+):
     backup_path = get_backup_path(backup_id)
-    zip_files = sorted(backup_path.glob("slackdump_*.zip"), reverse=True)
+    zip_files = list_merge_sources(backup_path)
 
     if not zip_files:
         return None
 
     print("既存のバックアップをマージ中...")
     merged_dir = Path(tempfile.mkdtemp())
-    conflict_count = {}
-
-    # Add progress bar for zip files
-    for zip_path in tqdm(zip_files, desc="ZIPファイル処理"):
-        with zipfile.ZipFile(zip_path) as zf:
-            members = zf.namelist()
-            # Add progress bar for files within each zip
-            for member in tqdm(members, desc=f"{zip_path.name} 展開", leave=False):
-                target_path = merged_dir / member
-
-                if target_path.exists():
-                    base, ext = os.path.splitext(member)
-                    while target_path.exists():
-                        count = conflict_count.get(member, 0) + 1
-                        conflict_count[member] = count
-                        new_name = f"{base}_{count}{ext}"
-                        target_path = merged_dir / new_name
-
-                zf.extract(member, merged_dir)
-
-    print("マージしたファイルを圧縮中...")
     merged_zip = backup_path / f"merged_{get_timestamp()}.zip"
-    with zipfile.ZipFile(merged_zip, "w", zipfile.ZIP_DEFLATED) as zf:
+    # 書き終えてからリネームし、途中で止まっても壊れた merged_*.zip を残さない
+    tmp_zip = merged_zip.with_name(f".{merged_zip.name}.tmp")
+    try:
+        _merge_into(
+            zip_files, merged_dir, tmp_zip, compression, compresslevel, workers, executor
+        )
+        os.replace(tmp_zip, merged_zip)
+    finally:
+        tmp_zip.unlink(missing_ok=True)
+        shutil.rmtree(merged_dir)
+    return merged_zip
+
+
+def _merge_into(
+    zip_files,
+    merged_dir: Path,
+    merged_zip: Path,
+    compression: int,
+    compresslevel: int | None,
+    workers: int | None,
+    executor: ThreadPoolExecutor | None,
+):
+    """zip_files を merged_dir に重ねて展開し、merged_zip に圧縮する"""
+    # executor が渡されたときは、呼び出し側のスレッドプールで展開・圧縮する
+    if executor is None:
+        pool = ThreadPoolExecutor(max_workers=workers)
+    else:
+        pool = nullcontext(executor)
+    with pool as executor:
+        # Add progress bar for zip files
+        # 古いZIPから順に重ね、同じファイルは前のZIPの内容とまとめるので、ZIP単位では順番に処理する
+        for zip_path in tqdm(zip_files, desc="ZIPファイル処理"):
+            with zipfile.ZipFile(zip_path) as zf:
+                members = zf.namelist()
+                futures = [
+                    executor.submit(_extract_member, zf, member, merged_dir)
+                    for member in members
+                ]
+                # Add progress bar for files within each zip
+                for future in tqdm(
+                    as_completed(futures),
+                    total=len(futures),
+                    desc=f"{zip_path.name} 展開",
+                    leave=False,
+                ):
+                    future.result()
+
+        print("マージしたファイルを圧縮中...")
         files_to_zip = []
         for root, _, files in os.walk(merged_dir):
             for file in files:
@@ -113,24 +332,31 @@ def merge_zip_files(backup_id: str):
                     (Path(root) / file, str(Path(root).relative_to(merged_dir) / file))
                 )
 
-        for file_path, arc_name in tqdm(files_to_zip, desc="圧縮"):
-            zf.write(file_path, arc_name)
-
-    shutil.rmtree(merged_dir)
-    return merged_zip
-
-
-def run_slackdump(token, cookie, backup_id: str):
-    os.environ["SLACK_TOKEN"] = token
-    os.environ["COOKIE"] = cookie
-
-    print("Slackデータをエクスポート中...")
+        # 読み込みと圧縮はスレッドプールで並列に行い、圧縮済みのデータを順番に書き込む
+        with zipfile.ZipFile(merged_zip, "w") as zf:
+            compressed = prefetch(
+                executor,
+                lambda item: compress_file(*item, compression, compresslevel),
+                files_to_zip,
+            )
+            for _, (zinfo, data) in tqdm(
+                compressed, total=len(files_to_zip), desc="圧縮"
+            ):
+                write_raw_member(zf, zinfo, [data])
+
+
+def run_slackdump(token, cookie, backup_id: str, work_path: Path, **merge_options):
+    # 複数のバックアップIDを並行して処理するため、環境変数はプロセスごとに渡す
+    env = dict(os.environ, SLACK_TOKEN=token, COOKIE=cookie)
+    dump_zip = work_path / "slackdump.zip"
+
+    print(f"[{backup_id}] Slackデータをエクスポート中...")
     subprocess.run(
         [
             "slackdump",
             "export",
             "-o",
-            "slackdump.zip",
+            str(dump_zip),
             "-type",
             "standard",
             "-files=false",
@@ -139,80 +365,247 @@ def run_slackdump(token, cookie, backup_id: str):
             "C07FD974XND",  # _24
         ],
         check=True,
+        env=env,
     )
 
     # Archive the new dump
-    archived_path = archive_with_timestamp("slackdump.zip", backup_id)
-    print(f"バックアップを保存しました: {archived_path}")
+    archived_path = archive_with_timestamp(dump_zip, backup_id)
+    print(f"[{backup_id}] バックアップを保存しました: {archived_path}")
 
     # Merge all existing dumps
-    merged_path = merge_zip_files(backup_id)
+    merged_path = merge_zip_files(backup_id, **merge_options)
     if merged_path:
-        print(f"マージされたファイルを作成しました: {merged_path}")
+        print(f"[{backup_id}] マージされたファイルを作成しました: {merged_path}")
         return merged_path
     return archived_path
 
 
+def load_journal(backup_id: str, args):
+    return RunJournal(
+        get_backup_path(backup_id) / "run_journal.json",
+        options={
+            "compact_text": args.compact_text,
+            "size_metric": args.size_metric,
+            "max_size": args.max_size,
+            "since": args.since and args.since.isoformat(),
+            "until": args.until and args.until.isoformat(),
+        },
+    )
 
 
-def main():
-    args = parse_args()
-    Path("html").mkdir(exist_ok=True)
-    Path("txt").mkdir(exist_ok=True)
-
-    try:
-        if not args.skip_dump:
-            token, cookie = get_credentials()
-            zip_path = run_slackdump(token, cookie, args.backup_id)
-
+def open_journal(backup_id: str, args):
+    journal = load_journal(backup_id, args)
+    if args.restart:
+        journal.reset()
+    elif journal.resumed:
+        print(f"[{backup_id}] 前回中断した処理を再開します")
+    return journal
+
+
+def process_backup(backup_id: str, args, credentials):
+    """バックアップIDひとつ分のダンプから分析までを、その作業ディレクトリで実行する
+
+    別のプロセスで実行できるよう、ジャーナルとZIPの展開・圧縮用のスレッドプールはここで用意する。
+    """
+    journal = load_journal(backup_id, args)
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        return _process_backup(backup_id, args, journal, credentials, executor)
+
+
+def _process_backup(backup_id: str, args, journal: RunJournal, credentials, executor):
+    started = time.monotonic()
+    work_path = get_work_path(backup_id)
+    dump_dir = work_path / "slackdump"
+    html_dir = work_path / "html"
+    txt_dir = work_path / "txt"
+    merge_options = {
+        "compression": ZIP_CODECS[args.zip_codec],
+        "compresslevel": args.zip_level,
+        "workers": args.workers,
+        "executor": executor,
+    }
+
+    if credentials is not None:
+        # 新しくダンプする場合、前回中断したときのマージ結果や展開・変換の記録は古いので使わない
+        journal.reset("merge", "extract", "convert", "text", "analyze")
+        token, cookie = credentials
+        zip_path = run_slackdump(token, cookie, backup_id, work_path, **merge_options)
+        journal.mark_done("dump")
+        if not args.skip_merge:
+            # run_slackdump が新しいスナップショットを含めてマージ済み
+            journal.mark_done("merge", value=str(zip_path))
+
+    if journal.is_done("merge") and Path(journal.get("merge")).exists():
+        zip_path = Path(journal.get("merge"))
+    elif args.skip_merge:
+        _zip_path = get_backup_path(backup_id) / "slackdump_20240821_000000.zip"
+
+        zip_path = work_path / "slackdump.zip"
+        if not zip_path.exists():
+            zip_path = atomic_copy(_zip_path, zip_path)
+    else:
+        zip_path = merge_zip_files(backup_id, **merge_options)
+        if not zip_path:
+            raise FileNotFoundError("マージするファイルが見つかりません")
+    journal.mark_done("merge", value=str(zip_path))
+
+    if not args.skip_convert and not journal.is_done("convert"):
+        # JSON をパースする前に、スナップショットのメタデータからチャンネルの規模を確認する
         if args.skip_merge:
-            _zip_path = Path(f"./backups/{args.backup_id}/slackdump_20240821_000000.zip")
-
-            if not Path("./slackdump.zip").exists():
-                zip_path = Path(shutil.copy2(_zip_path, "./slackdump.zip"))
-            else:
-                zip_path = Path("./slackdump.zip")
+            index_sources = [zip_path]
         else:
-            zip_path = merge_zip_files(args.backup_id)
-            if not zip_path:
-                print("マージするファイルが見つかりません")
-                sys.exit(1)
-
-        if not args.skip_convert:
-            print("HTMLファイルに変換中...")
-            # subprocess.run(
-            #     ["python", "dump2html.py", "-i", str(zip_path), "-o", "./html"],
-            #     check=True,
-            # )
-
-            # unzip
+            index_sources = list_merge_sources(get_backup_path(backup_id))
+        index = load_channel_index(index_sources)
+        print_channel_index(index)
+        # ブラックリストのチャンネルを除いた、変換するチャンネル
+        dump_folders = select_channels(index)
+
+        print(f"[{backup_id}] HTMLファイルに変換中...")
+
+        # unzip (変換するチャンネルの日別ファイルと users.json などだけを展開する)
+        if not journal.is_done("extract"):
+            # 前回展開したファイルが残っていると、マージ結果にない日別ファイルまで変換してしまう
+            shutil.rmtree(dump_dir)
+            dump_dir.mkdir()
+            if not journal.is_started("convert"):
+                for file_path in html_dir.glob("*.html"):
+                    file_path.unlink()
+            selected = set(dump_folders)
             with zipfile.ZipFile(zip_path, "r") as zip_ref:
-                zip_ref.extractall("./slackdump")
-
-            # dump folder nameをすべて取得
-            dump_folders = [f.name for f in Path("./slackdump").glob("*") if f.is_dir()]
-            SlackJsonToHtml(Path("./slackdump"), "./html", dump_folders)
-
-        print("テキストファイルを生成中...")
-                # メイン処理
-        folder_path = "./html"
-        output_folder = "./txt"
-
-        collect_and_process_html_files(folder_path, output_folder)
-
-        if not args.skip_analyze:
-            analyze_consolidate_and_clean_files(output_folder)
+                members = [
+                    name
+                    for name in zip_ref.namelist()
+                    if parse_day_file(name) is None
+                    or parse_day_file(name)[0] in selected
+                ]
+                if args.since or args.until:
+                    # 期間外の日別ファイルは展開しない
+                    members = select_window_members(
+                        zip_ref, members, args.since, args.until
+                    )
+                zip_ref.extractall(dump_dir, members)
+            journal.mark_done("extract")
+
+        SlackJsonToHtml(
+            dump_dir,
+            str(html_dir),
+            dump_folders,
+            compact=args.compact_text,
+            journal=journal,
+            since=args.since,
+            until=args.until,
+        )
+        journal.mark_done("convert")
+
+    print(f"[{backup_id}] テキストファイルを生成中...")
+
+    # 分割・結合の途中で止まった txt は入力が消えている可能性があるので作り直す
+    if journal.is_started("analyze") and not journal.is_done("analyze"):
+        journal.reset("text", "analyze")
+    if not journal.is_started("text"):
+        for file_path in txt_dir.glob("*.txt"):
+            file_path.unlink()
+        journal.start("text")
+
+    # テキストを書き込むときにサイズを記録し、分析で読み直さない
+    partitioner = make_partitioner(
+        txt_dir, threshold=args.max_size, metric=args.size_metric
+    )
+    collect_and_process_html_files(
+        html_dir, txt_dir, journal=journal, partitioner=partitioner
+    )
+    journal.mark_done("text")
+
+    if not args.skip_analyze:
+        journal.start("analyze")
+        analyze_consolidate_and_clean_files(
+            txt_dir,
+            threshold=args.max_size,
+            chart_path=work_path / "file_sizes_chart.png",
+            metric=args.size_metric,
+            partitioner=partitioner,
+        )
+        journal.mark_done("analyze")
+
+    journal.finish()
+
+    return {
+        "txt_dir": txt_dir,
+        "files": len(list(txt_dir.glob("*.txt"))),
+        "elapsed": time.monotonic() - started,
+    }
+
+
+def print_summary(results: dict):
+    print("\n===== 処理結果 =====")
+    for backup_id, result in results.items():
+        if "error" in result:
+            print(f"[{backup_id}] 失敗: {result['error']}")
+        else:
+            print(
+                f"[{backup_id}] {result['txt_dir']} に {result['files']} 個のテキストファイル"
+                f" ({result['elapsed']:.1f} 秒)"
+            )
 
-        print("\n処理が完了しました")
-        print("./txtディレクトリに47個のテキストファイルが生成されています")
-        print("これらのファイルをNotebookLMにアップロードしてください")
 
-    except subprocess.CalledProcessError as e:
-        print(f"エラーが発生しました: {e}")
+def main():
+    args = parse_args()
+    backup_ids = list(dict.fromkeys(args.backup_ids))
+
+    if args.watch:
+        # ダンプは行わず、backups/<バックアップID>/ に置かれたスナップショットを処理し続ける
+        watch(
+            {
+                backup_id: SnapshotWatcher(
+                    get_backup_path(backup_id),
+                    get_work_path(backup_id),
+                    args,
+                    cache_size=args.cache_size,
+                )
+                for backup_id in backup_ids
+            },
+            interval=args.interval,
+        )
+        return
+
+    # 入力が必要なトークンとクッキーは、並行処理を始める前にIDごとに聞いておく
+    credentials = {}
+    for backup_id in backup_ids:
+        journal = open_journal(backup_id, args)
+        credentials[backup_id] = None
+        if not args.skip_dump and not journal.is_done("dump"):
+            if len(backup_ids) > 1:
+                print(f"[{backup_id}]")
+            credentials[backup_id] = get_credentials()
+
+    results = {}
+    # IDごとの処理は JSON のパースや正規表現など GIL を離さない処理が中心なので、
+    # 複数のIDはプロセスで並行させる（IDがひとつならプロセスを起動しない）
+    if len(backup_ids) > 1:
+        jobs = ProcessPoolExecutor(max_workers=args.jobs or len(backup_ids))
+    else:
+        jobs = ThreadPoolExecutor(max_workers=1)
+    with jobs:
+        futures = {
+            jobs.submit(
+                process_backup, backup_id, args, credentials[backup_id]
+            ): backup_id
+            for backup_id in backup_ids
+        }
+        for future in as_completed(futures):
+            backup_id = futures[future]
+            try:
+                results[backup_id] = future.result()
+            except Exception as e:
+                print(f"[{backup_id}] エラーが発生しました: {e}")
+                results[backup_id] = {"error": e}
+
+    print_summary({backup_id: results[backup_id] for backup_id in backup_ids})
+    if any("error" in result for result in results.values()):
         sys.exit(1)
 
-    # htmlディレクトリを削除
-    # shutil.rmtree("html")
+    print("\n処理が完了しました")
+    print("txt ディレクトリのテキストファイルをNotebookLMにアップロードしてください")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,9 @@
+# 変換しないチャンネル（チャンネル名の一部に一致したものを除外する）
+channel_blacklist = [
+    "rss_news", 
+    "times_shoma_nagata",
+    "times_yuki_automated"
+]
+
+def is_blacklisted(name):
+    return any(channel in name for channel in channel_blacklist)
@@ -0,0 +1,151 @@
+import argparse
+import json
+import re
+import zipfile
+from pathlib import Path
+
+from blacklist import is_blacklisted
+from journal import atomic_write_text
+
+# slackdump の標準エクスポートは <チャンネル名>/<YYYY-MM-DD>.json にその日の投稿を保存する
+DAY_FILE_PATTERN = re.compile(r"^(?P<channel>[^/]+)/(?P<date>\d{4}-\d{2}-\d{2})\.json$")
+# 投稿ごとに一つだけ現れるキー。JSON をパースせずに投稿数を数えるのに使う
+MESSAGE_PATTERN = re.compile(rb'"type"\s*:\s*"message"')
+
+
+def parse_day_file(name: str):
+    """ZIPメンバー名が日別ファイルなら (チャンネル名, 日付文字列) を返す"""
+    match = DAY_FILE_PATTERN.match(name)
+    if not match:
+        return None
+    return match["channel"], match["date"]
+
+
+def build_file_index(zip_path, count_messages: bool = True) -> dict:
+    """ZIPのセントラルディレクトリから日別ファイルごとの統計を作成"""
+    index = {}
+    with zipfile.ZipFile(zip_path) as zf:
+        for info in zf.infolist():
+            if parse_day_file(info.filename) is None:
+                continue
+            messages = None
+            if count_messages:
+                # 展開はするが JSON のパースはしない
+                messages = len(MESSAGE_PATTERN.findall(zf.read(info)))
+            index[info.filename] = {"bytes": info.file_size, "messages": messages}
+    return index
+
+
+def get_index_path(zip_path) -> Path:
+    zip_path = Path(zip_path)
+    return zip_path.with_name(f"{zip_path.stem}.index.json")
+
+
+def load_file_index(zip_path, count_messages: bool = True) -> dict:
+    """日別ファイルの統計を取得。ZIPの隣にキャッシュし、ZIPが変わっていなければ再利用する"""
+    zip_path = Path(zip_path)
+    index_path = get_index_path(zip_path)
+    stat = zip_path.stat()
+    key = {
+        "zip": zip_path.name,
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "messages": count_messages,
+    }
+
+    if index_path.exists():
+        with index_path.open("r", encoding="utf-8") as f:
+            cached = json.load(f)
+        if cached.get("key") == key:
+            return cached["files"]
+
+    index = build_file_index(zip_path, count_messages=count_messages)
+    atomic_write_text(
+        index_path,
+        json.dumps({"key": key, "files": index}, ensure_ascii=False, indent=2),
+    )
+    return index
+
+
+def load_channel_index(zip_paths, count_messages: bool = True) -> dict:
+    """マージするZIPごとの統計を合わせて、チャンネルごとの統計を作成
+
+    マージ結果のZIPは実行のたびに作り直されるので、変わることのないスナップショットごとに
+    統計をキャッシュする。同じ日別ファイルが複数のZIPにある場合、マージでは投稿単位でまとめるので、
+    サイズと投稿数はそれぞれの最大値で見積もる。
+
+    Args:
+        zip_paths: merge_zip_files が展開する順番に並べたZIPのパス
+        count_messages: 投稿数も数えるかどうか（数えない場合はセントラルディレクトリだけを読む）
+    """
+    files = {}
+    for zip_path in zip_paths:
+        for name, file_stats in load_file_index(zip_path, count_messages).items():
+            if name not in files:
+                files[name] = dict(file_stats)
+                continue
+            files[name]["bytes"] = max(files[name]["bytes"], file_stats["bytes"])
+            if file_stats["messages"] is not None:
+                files[name]["messages"] = max(
+                    files[name]["messages"] or 0, file_stats["messages"]
+                )
+
+    index = {}
+    for name, file_stats in sorted(files.items()):
+        channel, date = parse_day_file(name)
+        stats = index.setdefault(
+            channel,
+            {"bytes": 0, "days": 0, "first": date, "last": date, "messages": None},
+        )
+        stats["bytes"] += file_stats["bytes"]
+        stats["days"] += 1
+        stats["first"] = min(stats["first"], date)
+        stats["last"] = max(stats["last"], date)
+        if file_stats["messages"] is not None:
+            stats["messages"] = (stats["messages"] or 0) + file_stats["messages"]
+    return index
+
+
+def select_channels(index: dict) -> list:
+    """ブラックリストのチャンネルを除き、サイズの大きい順にチャンネル名を返す"""
+    ranked = sorted(index.items(), key=lambda item: item[1]["bytes"], reverse=True)
+    return [channel for channel, _ in ranked if not is_blacklisted(channel)]
+
+
+def print_channel_index(index: dict, top_n: int = 47):
+    """サイズ順にチャンネルを表示し、個別ファイルに残るチャンネルの見込みを示す"""
+    channels = select_channels(index)
+    total = sum(index[channel]["bytes"] for channel in channels)
+    print(f"{len(channels)} チャンネル, 合計 {total / 1024 / 1024:.1f} MB (JSON)")
+    for rank, channel in enumerate(channels, 1):
+        stats = index[channel]
+        mark = "*" if rank <= top_n else " "
+        messages = "-" if stats["messages"] is None else stats["messages"]
+        print(
+            f"{mark} {rank:3d} {channel}: {stats['bytes'] / 1024:.1f} KB, "
+            f"{stats['days']} 日, {messages} 件, {stats['first']} - {stats['last']}"
+        )
+    excluded = sorted(set(index) - set(channels))
+    if excluded:
+        print(f"ブラックリストで除外: {', '.join(excluded)}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "zip_paths", nargs="+", help="slackdump zip files in merge order"
+    )
+    parser.add_argument("--top-n", type=int, default=47)
+    parser.add_argument(
+        "--no-messages",
+        action="store_true",
+        help="Skip counting messages (central directory only)",
+    )
+    args = parser.parse_args()
+
+    index = load_channel_index(args.zip_paths, count_messages=not args.no_messages)
+    print_channel_index(index, args.top_n)
+
+
+if __name__ == "__main__":
+    main()
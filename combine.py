@@ -1,9 +1,70 @@
+from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import List, Tuple
+from typing import Dict, List, Tuple
 from math import ceil
 import re
 from io import StringIO
 
+from journal import atomic_write_text
+
+# 日本語・中国語・韓国語の文字。単語の区切りがないので 1 文字を 1 語と数える
+CJK_CHARACTERS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af\uff66-\uff9f"
+
+
+class SizeMetric(ABC):
+    """テキストの大きさを測る指標の基底クラス
+
+    テキストを連結したときの大きさが各部分の大きさの和になるように実装する。
+    """
+
+    name = ""
+
+    @abstractmethod
+    def measure(self, text: str) -> int:
+        """テキストの大きさを返す"""
+
+
+class CharacterMetric(SizeMetric):
+    """文字数"""
+
+    name = "characters"
+
+    def measure(self, text: str) -> int:
+        return len(text)
+
+
+class Utf8ByteMetric(SizeMetric):
+    """UTF-8 でエンコードしたときのバイト数"""
+
+    name = "bytes"
+
+    def measure(self, text: str) -> int:
+        return len(text.encode("utf-8"))
+
+
+class WordMetric(SizeMetric):
+    """おおよその単語数（トークン数の目安）。CJK の文字は 1 文字を 1 語と数える"""
+
+    name = "words"
+    pattern = re.compile(f"[{CJK_CHARACTERS}]|[^\\s{CJK_CHARACTERS}]+")
+
+    def measure(self, text: str) -> int:
+        return sum(1 for _ in self.pattern.finditer(text))
+
+
+SIZE_METRICS = {
+    metric.name: metric for metric in (CharacterMetric(), Utf8ByteMetric(), WordMetric())
+}
+
+
+def get_size_metric(metric) -> SizeMetric:
+    """指標名（characters, bytes, words）または SizeMetric を SizeMetric にする"""
+    if isinstance(metric, SizeMetric):
+        return metric
+    if metric not in SIZE_METRICS:
+        raise ValueError(f"Unknown size metric: {metric}")
+    return SIZE_METRICS[metric]
+
 
 class FilePartitioner:
     """ファイル分割・結合を管理するクラス"""
@@ -16,15 +77,17 @@ class FilePartitioner:
         split_pattern: str = r"\n\s*\n",
         join_pattern: str = "\n\n",
         encoding: str = "utf-8",
+        metric: str | SizeMetric = "characters",
     ):
         """
         Args:
-            max_size: 出力ファイルの最大サイズ（バイト）
+            max_size: 出力ファイルの最大サイズ（metric の単位）
             max_files: 出力ファイルの最大数
             output_dir: 出力ディレクトリのパス
             split_pattern: 分割に使用する正規表現パターン
             join_pattern: ファイル結合時の区切りパターン
             encoding: ファイルのエンコーディング
+            metric: サイズの指標（characters, bytes, words または SizeMetric）
         """
         self.max_size = max_size
         self.max_files = max_files
@@ -33,12 +96,56 @@ class FilePartitioner:
         self.split_pattern = re.compile(split_pattern)
         self.join_pattern = join_pattern
         self.encoding = encoding
+        self.metric = get_size_metric(metric)
         # 結合パターンのサイズを計算
-        self.join_pattern_size = len(join_pattern.encode(encoding))
+        self.join_pattern_size = self.measure(join_pattern)
+        # ファイルを読み直さないよう、ファイルとブロックのサイズを覚えておく
+        self._file_sizes: Dict[Path, int] = {}
+        self._block_sizes: Dict[Path, List[int]] = {}
+
+    def measure(self, text: str) -> int:
+        """文字列のサイズを指標に従って計算"""
+        return self.metric.measure(text)
+
+    def measure_text(
+        self, content: str, with_blocks: bool = False
+    ) -> Tuple[int, List[int] | None]:
+        """テキストのサイズと、上限を超える（または with_blocks の）場合はブロックごとのサイズを返す"""
+        size = self.measure(content)
+        block_sizes = None
+        if with_blocks or size > self.max_size:
+            block_sizes = [
+                self.measure(block) for block in self.split_text_by_pattern(content)
+            ]
+        return size, block_sizes
+
+    def remember(self, path: Path, size: int, block_sizes: List[int] | None = None):
+        """測り済みのサイズを記録する（measure_text の結果をそのまま渡せる）"""
+        self._forget(path)
+        self._file_sizes[path] = size
+        if block_sizes is not None:
+            self._block_sizes[path] = block_sizes
+
+    def record(self, path: Path, content: str, with_blocks: bool = False):
+        """ファイルに書き込んだ内容のサイズを記録し、後で読み直さずに済むようにする"""
+        self.remember(path, *self.measure_text(content, with_blocks))
+
+    def _measure_file(self, path: Path, with_blocks: bool = False):
+        # record されていないファイルだけを一度読み、全体と（必要なら）ブロックごとのサイズを記録
+        if path in self._file_sizes and (not with_blocks or path in self._block_sizes):
+            return
+        with path.open("r", encoding=self.encoding) as f:
+            content = f.read()
+        self.record(path, content, with_blocks=with_blocks)
 
-    def count_characters(self, text: str) -> int:
-        """文字列のバイトサイズを計算"""
-        return len(text)
+    def get_block_sizes(self, path: Path) -> List[int]:
+        """ファイルをパターンで分割したブロックごとのサイズを取得"""
+        self._measure_file(path, with_blocks=True)
+        return self._block_sizes[path]
+
+    def _forget(self, path: Path):
+        self._file_sizes.pop(path, None)
+        self._block_sizes.pop(path, None)
 
     def split_text_by_pattern(self, text: str) -> List[str]:
         """テキストを正規表現パターンで分割"""
@@ -56,11 +163,11 @@ class FilePartitioner:
             content = f.read()
 
         blocks = self.split_text_by_pattern(content)
+        block_sizes = self.get_block_sizes(input_path)
         current_part = StringIO()
         current_size = 0
 
-        for block in blocks:
-            block_size = self.count_characters(block)
+        for block, block_size in zip(blocks, block_sizes):
 
             if block_size > self.max_size:
                 # 現在のパートを保存
@@ -74,7 +181,7 @@ class FilePartitioner:
                 # 大きいブロックを行単位で分割
                 lines = block.splitlines(True)
                 for line in lines:
-                    line_size = self.count_characters(line)
+                    line_size = self.measure(line)
                     if current_size + line_size > self.max_size:
                         if current_size > 0:
                             output_path = self._save_part(
@@ -103,6 +210,7 @@ class FilePartitioner:
             output_paths.append(output_path)
 
         input_path.unlink()
+        self._forget(input_path)
 
         return output_paths
 
@@ -115,8 +223,8 @@ class FilePartitioner:
             self.output_dir / f"{input_path.stem}_part{part_number}{input_path.suffix}"
         )
 
-        with output_path.open("w", encoding=self.encoding) as out_f:
-            out_f.write(content)
+        atomic_write_text(output_path, content, encoding=self.encoding)
+        self.record(output_path, content)
 
         return output_path
 
@@ -133,18 +241,26 @@ class FilePartitioner:
                     total_content.write(self.join_pattern)
                 total_content.write(content)
                 first_file = False
-            file_path.unlink()
 
         content = total_content.getvalue()
-        with output_path.open("w", encoding=self.encoding) as out_f:
-            out_f.write(content)
+        atomic_write_text(output_path, content, encoding=self.encoding)
+        # 結合結果のサイズは入力ファイルと区切りのサイズの和
+        total_size = sum(self.get_file_size(file_path) for file_path in files)
+        total_size += self.join_pattern_size * (len(files) - 1)
+
+        # 結合結果を書き終えてから入力ファイルを削除
+        for file_path in files:
+            file_path.unlink()
+            self._forget(file_path)
+        self._forget(output_path)
+        self._file_sizes[output_path] = total_size
 
         return output_path
 
     def get_file_size(self, path: Path) -> int:
-        """ファイルのサイズを取得"""
-        with path.open("r", encoding=self.encoding) as f:
-            return self.count_characters(f.read())
+        """ファイルのサイズを取得（一度測ったファイルは読み直さない）"""
+        self._measure_file(path)
+        return self._file_sizes[path]
 
     def is_feasible(self, files: List[Path]) -> bool:
         """問題が実現可能かどうかを判定"""
@@ -155,14 +271,10 @@ class FilePartitioner:
             size = self.get_file_size(file_path)
 
             if size > self.max_size:
-                with file_path.open("r", encoding=self.encoding) as f:
-                    content = f.read()
-                blocks = self.split_text_by_pattern(content)
                 current_size = 0
                 parts_needed = 1
 
-                for block in blocks:
-                    block_size = self.count_characters(block)
+                for block_size in self.get_block_sizes(file_path):
                     if block_size > self.max_size:
                         parts_needed += ceil(block_size / self.max_size)
                         continue
@@ -275,7 +387,7 @@ def main():
         output_files = partitioner.process_files(input_files)
         print(f"Successfully processed files. Output files: {len(output_files)}")
         for f in output_files:
-            print(f"- {f.name}: {partitioner.get_file_size(f) / 1024:.2f} KB")
+            print(f"- {f.name}: {partitioner.get_file_size(f)} {partitioner.metric.name}")
     except ValueError as e:
         print(f"Error: {e}")
     except Exception as e:
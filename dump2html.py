@@ -2,6 +2,7 @@ import argparse
 import glob
 import json
 import os
+import re
 import datetime
 
 
@@ -45,7 +46,10 @@ class HtmlWriter:
             'th, td': {'border': '1px solid black', 'font-size': '13px', 'padding': '3px'},
             'tr td:nth-of-type(1)': {'width': '100px', 'background': '#f0f0f0'},
             'tr td:nth-of-type(2)': {'width': '500px', 'word-break': 'break-all'}}
-        self.obh = open(out_html, mode='w', encoding='utf-8', newline='\n')
+        # 書きかけのファイルを残さないよう、一時ファイルに書いて close でリネームします。
+        self.out_html = out_html
+        self.tmp_html = out_html + '.tmp'
+        self.obh = open(self.tmp_html, mode='w', encoding='utf-8', newline='\n')
         self.write('<html>')
         self.write('<head>')
         self.write('<meta charset="UTF-8"/>')
@@ -58,6 +62,7 @@ class HtmlWriter:
         self.write('</body>')
         self.write('</html>')
         self.obh.close()
+        os.replace(self.tmp_html, self.out_html)
 
 
 class TableWriter:
@@ -78,36 +83,115 @@ class TableWriter:
 class SlackJsonToHtml:
     """ Slack からエクスポートした JSON データを HTML 形式に変換します。
     """
-    def __init__(self, in_dir, out_dir, channel_names):
+    def __init__(self, in_dir, out_dir, channel_names, compact=False, journal=None,
+                 since=None, until=None, day_cache=None):
         self.in_dir = in_dir
         self.out_dir = out_dir
+        self.compact = compact
+        self.since = since  # datetime.date を指定するとその日以降の日別ファイルだけを読みます。
+        self.until = until  # datetime.date を指定するとその日以前の日別ファイルだけを読みます。
+        self.journal = journal  # 指定されたときは変換済みのチャンネルを記録し、再実行時に飛ばします。
+        # 指定されたときは日別ファイルの投稿をファイルの更新時刻とサイズをキーに覚えておきます。
+        # get() と [] での代入ができるもの (dict や watch.LRUCache) を渡してください。
+        self.day_cache = day_cache
+        # チャンネル名から (通常表示の文字数, 実際に書き出した文字数) への辞書です。
+        self.char_counts = {}
 
-        # ユーザIDと名前の対応辞書をつくります。
-        with open(os.path.join(self.in_dir, 'users.json'), mode='r', encoding='utf-8') as ojf:
-            data_users = json.load(ojf)
-        self.users = {user['id']: user['real_name'] for user in data_users}
+        self.load_users()
 
         # 対象チャンネルをダンプします。
         for channel_name in channel_names:
+            if self.journal and self.journal.is_done('convert', channel_name):
+                continue
             self.dump_channel(channel_name)
+            if self.journal:
+                self.journal.mark_done('convert', channel_name)
+        if self.compact and channel_names:
+            self.report_savings()
+
+    def load_users(self):
+        # ユーザIDと名前の対応辞書と、ユーザIDをまとめて置換する正規表現をつくります。
+        with open(os.path.join(self.in_dir, 'users.json'), mode='r', encoding='utf-8') as ojf:
+            data_users = json.load(ojf)
+        self.users = {user['id']: user['real_name'] for user in data_users}
+        ids = sorted(self.users, key=len, reverse=True)  # 長い ID を優先して照合します。
+        self.users_pattern = re.compile('|'.join(map(re.escape, ids))) if ids else None
+
+    def load_posts(self, json_file):
+        # 日別ファイルの投稿を読みます。dump_channel が投稿を書き換えるので複製を返します。
+        if self.day_cache is None:
+            with open(json_file, mode='r', encoding='utf-8') as ojf:
+                return json.load(ojf)
+        stat = os.stat(json_file)
+        key = (json_file, stat.st_mtime_ns, stat.st_size)
+        posts = self.day_cache.get(key)
+        if posts is None:
+            with open(json_file, mode='r', encoding='utf-8') as ojf:
+                posts = json.load(ojf)
+            self.day_cache[key] = posts
+        return [dict(post) for post in posts]
 
     def to_str(self, *args):
         # args に渡された要素を文字列化し、ユーザ ID と HTML 特殊文字を解決します。
         s = '\n'.join([str(v) for v in args])
-        for k, v in self.users.items():
-            s = s.replace(k, v)
+        if self.users_pattern is not None:
+            s = self.users_pattern.sub(lambda m: self.users[m.group(0)], s)
         s = s.replace('<', '&lt;')
         s = s.replace('>', '&gt;')
         s = s.replace('\n', '<br/>')
         return s
 
+    def day_index(self, channel_name):
+        # YYYY-MM-DD.json というファイル名から、日付から日別ファイルへの辞書をつくります。
+        index = {}
+        for json_file in glob.glob(os.path.join(self.in_dir, channel_name, '*.json')):
+            stem = os.path.splitext(os.path.basename(json_file))[0]
+            try:
+                index[datetime.date.fromisoformat(stem)] = json_file
+            except ValueError:
+                continue
+        return index
+
+    def in_window(self, day):
+        return ((self.since is None or self.since <= day)
+                and (self.until is None or day <= self.until))
+
+    def parent_posts(self, posts, index, loaded):
+        # 期間内の返信について、期間外にあるスレッド先頭の投稿を探して返します。
+        # タイムゾーンの違いを考え、スレッド先頭時刻の前後 1 日の日別ファイルも探します。
+        known = {post['ts'] for post in posts}
+        missing = {post['thread_ts'] for post in posts
+                   if 'thread_ts' in post and post['thread_ts'] not in known}
+        cache = {}
+        parents = []
+        for thread_ts in sorted(missing, key=float):
+            day = datetime.date.fromtimestamp(float(thread_ts))
+            for d in (day, day - datetime.timedelta(days=1), day + datetime.timedelta(days=1)):
+                if d not in index or d in loaded:
+                    continue
+                if d not in cache:
+                    cache[d] = self.load_posts(index[d])
+                found = [post for post in cache[d] if post.get('ts') == thread_ts]
+                if found:
+                    parents.append(found[0])
+                    break
+        return parents
+
     def dump_channel(self, channel_name):
         # そのチャンネルのフォルダから全ての投稿を収集します。
-        json_files = glob.glob(os.path.join(self.in_dir, channel_name, '*.json'))
+        # 期間が指定されたときは、ファイル名の日付が期間内の日別ファイルだけを読みます。
+        windowed = self.since is not None or self.until is not None
+        if windowed:
+            index = self.day_index(channel_name)
+            loaded = {day for day in index if self.in_window(day)}
+            json_files = [index[day] for day in sorted(loaded)]
+        else:
+            json_files = glob.glob(os.path.join(self.in_dir, channel_name, '*.json'))
         posts = []
         for json_file in json_files:
-            with open(json_file, mode='r', encoding='utf-8') as ojf:
-                posts += json.load(ojf)
+            posts += self.load_posts(json_file)
+        if windowed:
+            posts = self.parent_posts(posts, index, loaded) + posts
 
         # 投稿をスレッドごとに束ねます。
         threads = []
@@ -128,15 +212,88 @@ class SlackJsonToHtml:
             else:  # thread_ts フィールドがない投稿はスレッドになっておらず単独で格納します。
                 threads.append([post])
 
+        # glob() の順番は決まっていないので、スレッド内の投稿を時刻順に並べます。
+        for thread in threads:
+            thread.sort(key=lambda post: post['ts'])
+
         # スレッド先頭日時降順に HTML に書き出します。
         out_html = os.path.join(self.out_dir, channel_name + '.html')
         hw = HtmlWriter(channel_name, out_html)
+        full_chars = 0
+        written_chars = 0
         for thread in reversed(threads):  # 昇順がよいときは reversed() を除去してください。
+            if self.compact:
+                rows, full, written = self.compact_rows(thread)
+                full_chars += full
+                written_chars += written
+            else:
+                rows = self.full_rows(thread)
+            if not rows:
+                continue
             tw = TableWriter(hw)
-            for post in thread:
-                tw.write(self.to_str(post['user'], post['ts']), self.to_str(get_text(post)))
+            for row in rows:
+                tw.write(*row)
             tw.close()
         hw.close()
+        if self.compact:
+            self.char_counts[channel_name] = (full_chars, written_chars)
+
+    def full_rows(self, thread):
+        # 投稿ごとに「ユーザ名と日時」「本文」の 2 列を作ります。
+        return [(self.to_str(post['user'], post['ts']), self.to_str(get_text(post)))
+                for post in thread]
+
+    def compact_rows(self, thread):
+        # 日付はスレッド先頭にだけ書き、以降は先頭からの相対時刻にします。
+        # 同じユーザの連続投稿は一行にまとめ、本文のない投稿は捨てます。
+        # 削減量の見積もりとして、通常表示とコンパクト表示のテキストの文字数も返します。
+        # (HTML のタグやエスケープを除いた文字数で、./txt の出力とは多少ずれます。)
+        rows = []
+        start = None
+        last_user = None
+        full_chars = 0
+        for post in thread:
+            name = self.users.get(post['user'], post['user'])
+            text = get_text(post).strip()
+            full_chars += len(name) + 1 + len('YYYY-MM-DD HH:MM:SS') + len(text)
+            if not get_text(dict(post, files=None)).strip():
+                continue
+            if post['user'] == last_user:
+                rows[-1][1].append(text)
+                continue
+            if start is None:
+                start = post['ts']
+                when = start.strftime('%Y-%m-%d %H:%M')
+            else:
+                when = format_delta(post['ts'] - start)
+            rows.append((f'{name} {when}', [text]))
+            last_user = post['user']
+        written_chars = sum(len(head) + len('\n'.join(texts)) for head, texts in rows)
+        rows = [(self.to_str(head), self.to_str('\n'.join(texts))) for head, texts in rows]
+        return rows, full_chars, written_chars
+
+    def report_savings(self):
+        # コンパクト表示で削減できた文字数を表示します。
+        full_total = sum(full for full, _ in self.char_counts.values())
+        written_total = sum(written for _, written in self.char_counts.values())
+        saved = full_total - written_total
+        ratio = saved / full_total * 100 if full_total else 0.0
+        print(f'コンパクト表示 (見積もり): 約 {full_total:,} -> {written_total:,} 文字 '
+              f'({saved:,} 文字, {ratio:.1f}% 削減)')
+
+
+def format_delta(delta) -> str:
+    # スレッド先頭からの経過時間を +5m, +2h10m, +3d のように短く表します。
+    if delta.total_seconds() < 0:
+        raise ValueError(f'スレッド先頭より前の時刻です: {delta}')
+    minutes = int(delta.total_seconds()) // 60
+    if minutes < 60:
+        return f'+{minutes}m'
+    hours, minutes = divmod(minutes, 60)
+    if hours < 24:
+        return f'+{hours}h{minutes:02d}m' if minutes else f'+{hours}h'
+    days, hours = divmod(hours, 24)
+    return f'+{days}d{hours}h' if hours else f'+{days}d'
 
 
 def get_text(item) -> str:
@@ -173,9 +330,15 @@ if __name__ == '__main__':
     parser.add_argument('-i', '--in_dir', required=True)
     parser.add_argument('-o', '--out_dir', required=True)
     parser.add_argument('-c', '--channel_names', required=True)
+    parser.add_argument('--compact', action='store_true')
+    parser.add_argument('--since', type=datetime.date.fromisoformat)
+    parser.add_argument('--until', type=datetime.date.fromisoformat)
     args = parser.parse_args()
+    if args.since and args.until and args.since > args.until:
+        parser.error('--since must be on or before --until')
 
     in_dir = os.path.expanduser(args.in_dir)
     out_dir = os.path.expanduser(args.out_dir)
     os.makedirs(out_dir, exist_ok=True)
-    SlackJsonToHtml(in_dir, out_dir, args.channel_names.split(','))
\ No newline at end of file
+    SlackJsonToHtml(in_dir, out_dir, args.channel_names.split(','), compact=args.compact,
+                    since=args.since, until=args.until)
\ No newline at end of file
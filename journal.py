@@ -0,0 +1,100 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def atomic_write_text(path, content: str, encoding: str = "utf-8"):
+    """一時ファイルに書き込んでからリネームし、書きかけのファイルを残さない"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(
+        dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+    )
+    try:
+        with os.fdopen(fd, "w", encoding=encoding) as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+class RunJournal:
+    """パイプラインのステージごとの完了状況を記録し、中断後に続きから再開するためのクラス"""
+
+    def __init__(self, path, options: dict | None = None):
+        """
+        Args:
+            path: ジャーナルファイルのパス
+            options: 実行オプション。前回の記録と異なる場合は最初からやり直す
+        """
+        self.path = Path(path)
+        self.options = options or {}
+        self.state = {"options": self.options, "stages": {}}
+
+        if self.path.exists():
+            with self.path.open("r", encoding="utf-8") as f:
+                state = json.load(f)
+            if state.get("options") == self.options:
+                self.state = state
+            else:
+                print("実行オプションが前回と異なるため、最初から処理します")
+
+    @property
+    def resumed(self) -> bool:
+        """前回の中断した実行から再開しているかどうか"""
+        return bool(self.state["stages"])
+
+    def _stage(self, stage: str) -> dict:
+        return self.state["stages"].setdefault(
+            stage, {"done": False, "items": [], "value": None}
+        )
+
+    def _commit(self):
+        atomic_write_text(self.path, json.dumps(self.state, ensure_ascii=False, indent=2))
+
+    def is_started(self, stage: str) -> bool:
+        """ステージが開始済みかどうか"""
+        return stage in self.state["stages"]
+
+    def is_done(self, stage: str, item: str | None = None) -> bool:
+        """ステージ（item を指定した場合はステージ内の項目）が完了済みかどうか"""
+        if stage not in self.state["stages"]:
+            return False
+        if item is None:
+            return self.state["stages"][stage]["done"]
+        return item in self.state["stages"][stage]["items"]
+
+    def get(self, stage: str):
+        """ステージの完了時に記録した値を取得"""
+        if stage not in self.state["stages"]:
+            return None
+        return self.state["stages"][stage]["value"]
+
+    def start(self, stage: str):
+        """ステージの開始を記録"""
+        self._stage(stage)
+        self._commit()
+
+    def mark_done(self, stage: str, item: str | None = None, value=None):
+        """ステージ（item を指定した場合はステージ内の項目）の完了を記録"""
+        entry = self._stage(stage)
+        if item is None:
+            entry["done"] = True
+            entry["value"] = value
+        elif item not in entry["items"]:
+            entry["items"].append(item)
+        self._commit()
+
+    def reset(self, *stages: str):
+        """指定したステージ（省略時はすべて）の記録を消去"""
+        if not stages:
+            stages = tuple(self.state["stages"])
+        for stage in stages:
+            self.state["stages"].pop(stage, None)
+        self._commit()
+
+    def finish(self):
+        """すべてのステージが完了したのでジャーナルを削除"""
+        self.path.unlink(missing_ok=True)
+        self.state["stages"] = {}
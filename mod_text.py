@@ -1,17 +1,14 @@
 from pathlib import Path
 import re
-import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import japanize_matplotlib
 
+from blacklist import channel_blacklist, is_blacklisted  # noqa: F401 (以前の import 先)
 from combine import FilePartitioner
+from journal import atomic_write_text
 
 break_line_pattern = r"\n\n\n"
 
-channel_blacklist = [
-    "rss_news", 
-    "times_shoma_nagata",
-    "times_yuki_automated"
-]
 
 def clean_html_content(content):
     content = re.sub(r"<head>(.|\n)*<title>(.*)<\/title>(.|\n)*<\/head>", r"\2", content)
@@ -39,7 +36,32 @@ def clean_html_content(content):
     return content
 
 
-def collect_and_process_html_files(folder_path, output_folder="./txt", pattern="*.html"):
+def process_html_file(file_path, new_file_path):
+    # HTML ファイルをテキストにして書き込み、書き込んだ内容を返す
+    with Path(file_path).open('r', encoding='utf-8') as f:
+        content = f.read()
+
+    print("Processing", Path(new_file_path).name)
+    cleaned_content = clean_html_content(content)
+
+    atomic_write_text(new_file_path, cleaned_content, encoding='utf-8')
+    return cleaned_content
+
+
+def make_partitioner(output_folder, top_n=47, threshold=100_0000, metric="characters"):
+    return FilePartitioner(
+        max_size=threshold,
+        max_files=top_n,
+        output_dir=Path(output_folder),
+        split_pattern=r"\n\n\n",
+        join_pattern="\n\n====================\n\n",
+        encoding="utf-8",
+        metric=metric,
+    )
+
+
+def collect_and_process_html_files(folder_path, output_folder="./txt", pattern="*.html", journal=None, partitioner=None):
+    # partitioner を渡すと、書き込んだテキストのサイズをその場で記録し、分析時に読み直さない
     folder = Path(folder_path)
     output_folder = Path(output_folder)
     output_folder.mkdir(parents=True, exist_ok=True)
@@ -47,38 +69,35 @@ def collect_and_process_html_files(folder_path, output_folder="./txt", pattern="
     processed_files = []
 
     for file_path in folder.rglob(pattern):
-        if any(channel in file_path.name for channel in channel_blacklist):
+        if is_blacklisted(file_path.name):
             continue
 
         new_filename = f"{file_path.name}.txt"
         new_file_path = output_folder / new_filename
 
-        with file_path.open('r', encoding='utf-8') as f:
-            content = f.read()
-
-        print("Processing", new_file_path.name)
-        cleaned_content = clean_html_content(content)
+        if journal and journal.is_done("text", file_path.name):
+            processed_files.append((file_path, new_file_path))
+            continue
 
-        with new_file_path.open('w', encoding='utf-8') as f:
-            f.write(cleaned_content)
+        cleaned_content = process_html_file(file_path, new_file_path)
+        if partitioner:
+            partitioner.record(new_file_path, cleaned_content)
+        if journal:
+            journal.mark_done("text", file_path.name)
 
         processed_files.append((file_path, new_file_path))
 
     return processed_files
 
 
-def analyze_consolidate_and_clean_files(output_folder, top_n=47, threshold=100_0000):
+def analyze_consolidate_and_clean_files(output_folder, top_n=47, threshold=100_0000, chart_path="file_sizes_chart.png", metric="characters", partitioner=None):
     output_dir = Path(output_folder)
 
     # Initialize FilePartitioner
-    partitioner = FilePartitioner(
-        max_size=threshold,
-        max_files=top_n,
-        output_dir=output_dir,
-        split_pattern=r"\n\n\n",
-        join_pattern="\n\n====================\n\n",
-        encoding="utf-8",
-    )
+    # (collect_and_process_html_files に渡したものを使うと、記録したサイズを再利用できる)
+    if partitioner is None:
+        partitioner = make_partitioner(output_dir, top_n, threshold, metric)
+    unit = partitioner.metric.name
 
     # Get file sizes and paths
     file_sizes: dict[Path, int] = {}
@@ -96,7 +115,7 @@ def analyze_consolidate_and_clean_files(output_folder, top_n=47, threshold=100_0
         # Print statistics
         for file_path in processed_files:
             size = partitioner.get_file_size(file_path)
-            print(f"{file_path.name}: {size} characters")
+            print(f"{file_path.name}: {size} {unit}")
 
         # Generate chart for non-split files
         normal_files = [
@@ -113,11 +132,13 @@ def analyze_consolidate_and_clean_files(output_folder, top_n=47, threshold=100_0
         print(f"Error: Unable to satisfy constraints - {e}")
         return [], []
 
-    plt.figure(figsize=(15, 10))
-    plt.bar(range(len(sizes)), sizes)
-    plt.xticks(range(len(labels)), labels, rotation=90)
-    plt.title('File Sizes (in characters)')
-    plt.xlabel('Files')
-    plt.ylabel('Number of characters')
-    plt.tight_layout()
-    plt.savefig('file_sizes_chart.png')
+    # 複数のバックアップIDを並行して処理できるよう、pyplot のグローバル状態を使わない
+    fig = Figure(figsize=(15, 10))
+    ax = fig.subplots()
+    ax.bar(range(len(sizes)), sizes)
+    ax.set_xticks(range(len(labels)), labels, rotation=90)
+    ax.set_title(f'File Sizes (in {unit})')
+    ax.set_xlabel('Files')
+    ax.set_ylabel(f'Number of {unit}')
+    fig.tight_layout()
+    fig.savefig(chart_path)
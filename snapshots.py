@@ -0,0 +1,313 @@
+"""
+backups/<バックアップID>/ にたまったスナップショットを整理します。
+
+古い slackdump_*.zip は、重複を除いた一つのベースアーカイブ (base_*.zip) と、
+その後に変わった日別ファイルだけを含む差分アーカイブ (delta_*.zip) にまとめます。
+差分アーカイブの日別ファイルはその日の投稿をすべて含むので、ベースの上に順に重ねれば復元できます。
+
+python snapshots.py compact -b default --keep 3
+"""
+
+import argparse
+import json
+import os
+import zipfile
+from datetime import datetime
+from pathlib import Path
+
+from channel_index import get_index_path, parse_day_file
+
+
+def list_snapshots(backup_path: Path):
+    return sorted(backup_path.glob("slackdump_*.zip"))
+
+
+def _archive_key(path: Path) -> str:
+    """base_*.zip・delta_*.zip の作成日時の部分（古い順に並ぶ文字列）"""
+    return path.name.split("_", 1)[1]
+
+
+def list_compacted(backup_path: Path):
+    """ベースアーカイブと、それに重ねる差分アーカイブを古い順に返す"""
+    bases = sorted(backup_path.glob("base_*.zip"), key=_archive_key)
+    base = bases[-1] if bases else None
+    deltas = sorted(backup_path.glob("delta_*.zip"), key=_archive_key)
+    if base is not None:
+        # ベースを作り直すと古い差分は削除されるので、同じ日時の差分はベースの後に作られたもの
+        deltas = [delta for delta in deltas if _archive_key(delta) >= _archive_key(base)]
+    return base, deltas
+
+
+def new_archive_path(backup_path: Path, prefix: str) -> Path:
+    """既存のどのベース・差分アーカイブよりも後に並ぶ、新しいアーカイブのパスを返す
+
+    同じ秒に作っても区別できるようマイクロ秒まで名前に含める。既存のアーカイブを
+    上書きしたり、順番が前後したりする名前になる場合（時計が戻った場合など）は RuntimeError。
+    """
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+    new_archive = backup_path / f"{prefix}_{timestamp}.zip"
+    existing = [*backup_path.glob("base_*.zip"), *backup_path.glob("delta_*.zip")]
+    if any(_archive_key(path) >= _archive_key(new_archive) for path in existing):
+        raise RuntimeError(
+            f"{new_archive.name} より新しいアーカイブがすでにあるため、作成できません"
+        )
+    return new_archive
+
+
+def list_merge_sources(backup_path: Path):
+    """merge_zip_files が重ねる順番（古い順）にZIPを並べる
+
+    ベース・差分アーカイブには残っているスナップショットより古い投稿しかないので、先に重ねる。
+    """
+    base, deltas = list_compacted(backup_path)
+    sources = [base] if base is not None else []
+    return sources + deltas + list_snapshots(backup_path)
+
+
+def _message_key(message: dict) -> str:
+    return message.get("ts") or json.dumps(message, sort_keys=True, ensure_ascii=False)
+
+
+def _sort_key(message: dict) -> float:
+    try:
+        return float(message.get("ts", 0))
+    except ValueError:
+        return 0.0
+
+
+def merge_messages(*message_lists) -> list:
+    """日別ファイルの投稿をまとめる。同じ ts の投稿は後のもの（新しいもの）で置き換える"""
+    messages = {}
+    for message_list in message_lists:
+        for message in message_list:
+            messages[_message_key(message)] = message
+    return sorted(messages.values(), key=_sort_key)
+
+
+def merge_day_file(old: bytes, new: bytes) -> bytes:
+    """同じ日別ファイルの古い版と新しい版をまとめた JSON を返す
+
+    スナップショットごとに、その後に届いた返信や取得できなくなった古い投稿があるので、
+    どちらか一方を選ぶのではなく投稿単位でまとめる。
+    """
+    if old == new:
+        return new
+    merged = merge_messages(json.loads(old), json.loads(new))
+    return json.dumps(merged, ensure_ascii=False, indent=2).encode("utf-8")
+
+
+class MergedView:
+    """複数のZIPを merge_zip_files と同じ規則で重ねた内容を、展開せずに読むクラス
+
+    日別ファイルは投稿単位でまとめ、それ以外のファイル（users.json など）は最後のZIPのものを使う。
+    """
+
+    def __init__(self, zip_paths):
+        """
+        Args:
+            zip_paths: 重ねる順番（古い順）に並べたZIPのパス
+        """
+        self.zip_files = [zipfile.ZipFile(zip_path) for zip_path in zip_paths]
+        self.sources = {}  # メンバー名 -> そのメンバーを含むZIP（古い順）
+        for zf in self.zip_files:
+            for info in zf.infolist():
+                if not info.is_dir():
+                    self.sources.setdefault(info.filename, []).append(zf)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        for zf in self.zip_files:
+            zf.close()
+
+    def names(self):
+        return sorted(self.sources)
+
+    def read(self, name: str) -> bytes:
+        """merge_zip_files が書き出すのと同じ内容を返す"""
+        sources = self.sources[name]
+        if parse_day_file(name) is None:
+            return sources[-1].read(name)
+        data = sources[0].read(name)
+        for zf in sources[1:]:
+            data = merge_day_file(data, zf.read(name))
+        return data
+
+    def messages(self, name: str) -> list:
+        """日別ファイルの投稿を ts 順に返す"""
+        return merge_messages(*(json.loads(zf.read(name)) for zf in self.sources[name]))
+
+
+def verify_merge(before_sources, after_sources) -> int:
+    """二つのZIPの並びをマージした結果が同じかを確かめ、投稿数を返す。異なれば ValueError"""
+    with MergedView(before_sources) as before, MergedView(after_sources) as after:
+        if before.sources.keys() != after.sources.keys():
+            raise ValueError("マージ結果のファイルの一覧が一致しません")
+        count = 0
+        for name in before.names():
+            if parse_day_file(name) is None:
+                if before.read(name) != after.read(name):
+                    raise ValueError(f"マージ結果が一致しません: {name}")
+                continue
+            messages = before.messages(name)
+            if messages != after.messages(name):
+                raise ValueError(f"マージ結果の投稿が一致しません: {name}")
+            count += len(messages)
+    return count
+
+
+def write_archive(zip_path: Path, view: MergedView, names) -> int:
+    """MergedView のメンバーをアーカイブに書き出し、書いたファイル数を返す"""
+    tmp_path = zip_path.with_name(f".{zip_path.name}.tmp")
+    written = 0
+    with zipfile.ZipFile(tmp_path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in names:
+            zf.writestr(name, view.read(name))
+            written += 1
+    os.replace(tmp_path, zip_path)
+    return written
+
+
+def _members(zip_path: Path):
+    with zipfile.ZipFile(zip_path) as zf:
+        return {info.filename for info in zf.infolist() if not info.is_dir()}
+
+
+def _remove(paths):
+    for path in paths:
+        path.unlink()
+        get_index_path(path).unlink(missing_ok=True)
+        print(f"削除しました: {path}")
+
+
+def compact(
+    backup_path: Path,
+    keep: int = 3,
+    keep_merged: int = 1,
+    max_deltas: int = 5,
+    dry_run: bool = False,
+):
+    """
+    古いスナップショットをベース・差分アーカイブにまとめ、不要になったファイルを削除します。
+
+    まとめる前後で merge_zip_files と同じ規則でマージした結果を比べ、一致した場合だけ削除します。
+
+    Args:
+        backup_path: バックアップディレクトリ (backups/<バックアップID>)
+        keep: そのまま残す新しいスナップショットの数
+        keep_merged: 残す merged_*.zip の数
+        max_deltas: 差分アーカイブがこの数を超えたらベースを作り直す
+        dry_run: 削除・作成する予定のファイルを表示するだけにする
+    """
+    snapshots = list_snapshots(backup_path)
+    to_fold = snapshots[: max(len(snapshots) - keep, 0)]
+    kept = snapshots[len(to_fold) :]
+    merged = sorted(backup_path.glob("merged_*.zip"))
+    stale_merged = merged[: max(len(merged) - keep_merged, 0)]
+    base, deltas = list_compacted(backup_path)
+    compacted = ([base] if base is not None else []) + deltas
+    rebase = base is None or len(deltas) + 1 > max_deltas
+
+    print(f"まとめるスナップショット: {len(to_fold)} 個")
+    for path in to_fold:
+        print(f"  {path.name}")
+    print(f"削除する merged_*.zip: {len(stale_merged)} 個")
+    if dry_run:
+        return
+
+    if to_fold:
+        before_sources = list_merge_sources(backup_path)
+        # 既存の名前は使わないので、新しいアーカイブが削除対象 (replaced) に入ることはない
+        new_archive = new_archive_path(backup_path, "base" if rebase else "delta")
+        with MergedView(compacted + to_fold) as view:
+            if rebase:
+                written = write_archive(new_archive, view, view.names())
+                replaced = compacted
+            else:
+                # まとめるスナップショットに含まれ、これまでの内容から変わったファイルだけを書く
+                with MergedView(compacted) as previous:
+                    names = sorted(
+                        name
+                        for name in set().union(*map(_members, to_fold))
+                        if name not in previous.sources
+                        or previous.read(name) != view.read(name)
+                    )
+                written = write_archive(new_archive, view, names)
+                replaced = []
+        if written == 0 and not rebase:
+            # 変更がなければ空の差分アーカイブは残さない
+            new_archive.unlink()
+        else:
+            print(f"作成しました: {new_archive} ({written} ファイル)")
+
+        # 削除した後に次のマージが実際に読むZIPで、まとめる前とマージ結果が一致することを確かめる
+        removed = set(to_fold + replaced)
+        after_sources = [
+            path for path in list_merge_sources(backup_path) if path not in removed
+        ]
+        try:
+            if new_archive.exists() and new_archive not in after_sources:
+                raise ValueError(f"{new_archive.name} が次のマージで読まれません")
+            count = verify_merge(before_sources, after_sources)
+        except ValueError as e:
+            new_archive.unlink(missing_ok=True)
+            raise RuntimeError(
+                f"{e}。まとめる前のマージ結果と一致しないため、何も削除していません"
+            ) from e
+        print(f"検証しました: マージ結果の {count} 件の投稿が一致")
+
+        _remove(to_fold + replaced)
+
+    _remove(stale_merged)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    compact_parser = subparsers.add_parser(
+        "compact", help="Fold old snapshots into a base archive plus deltas"
+    )
+    compact_parser.add_argument(
+        "--backup-id",
+        "-b",
+        default="default",
+        help="Backup namespace ID (default: default)",
+    )
+    compact_parser.add_argument(
+        "--keep",
+        type=int,
+        default=3,
+        help="Number of newest snapshots to keep as they are (default: 3)",
+    )
+    compact_parser.add_argument(
+        "--keep-merged",
+        type=int,
+        default=1,
+        help="Number of newest merged archives to keep (default: 1)",
+    )
+    compact_parser.add_argument(
+        "--max-deltas",
+        type=int,
+        default=5,
+        help="Rebuild the base archive when deltas exceed this count (default: 5)",
+    )
+    compact_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="Only show what would be compacted and deleted",
+    )
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compact(
+            Path("backups") / args.backup_id,
+            keep=args.keep,
+            keep_merged=args.keep_merged,
+            max_deltas=args.max_deltas,
+            dry_run=args.dry_run,
+        )
+
+
+if __name__ == "__main__":
+    main()
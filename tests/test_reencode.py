@@ -0,0 +1,74 @@
+import struct
+import zipfile
+import zlib
+
+import pytest
+
+from reencode import stream_reencode_zip
+
+
+class Cp932ZipInfo(zipfile.ZipInfo):
+    """メンバー名を UTF-8 フラグなしの cp932 で書き込む ZipInfo（Windows の ZIP を再現する）"""
+
+    __slots__ = ()
+
+    def _encodeFilenameFlags(self):
+        return self.filename.encode("cp932"), self.flag_bits
+
+
+def cp932_info(name: str, extra: bytes = b"") -> zipfile.ZipInfo:
+    info = Cp932ZipInfo(name, date_time=(2024, 1, 1, 0, 0, 0))
+    info.extra = extra
+    return info
+
+
+def test_cp932_names_round_trip(tmp_path):
+    input_zip = tmp_path / "input.zip"
+    output_zip = tmp_path / "output.zip"
+    with zipfile.ZipFile(input_zip, "w") as zf:
+        zf.writestr(cp932_info("日本語/2024-01-01.json"), "[]", zipfile.ZIP_DEFLATED)
+        zf.writestr(cp932_info("ﾃｽﾄ.txt"), "テスト" * 100, zipfile.ZIP_DEFLATED)
+        zf.writestr(zipfile.ZipInfo("ascii.txt"), "plain")
+
+    assert stream_reencode_zip(input_zip, output_zip) == 2
+
+    with zipfile.ZipFile(output_zip) as zf:
+        assert zf.testzip() is None
+        assert zf.namelist() == ["日本語/2024-01-01.json", "ﾃｽﾄ.txt", "ascii.txt"]
+        assert zf.read("日本語/2024-01-01.json") == b"[]"
+        assert zf.read("ﾃｽﾄ.txt").decode("utf-8") == "テスト" * 100
+        assert zf.read("ascii.txt") == b"plain"
+
+
+def test_unicode_path_field_is_preferred_and_kept(tmp_path):
+    input_zip = tmp_path / "input.zip"
+    output_zip = tmp_path / "output.zip"
+    raw_name = "ﾃｽﾄ.txt".encode("cp932")
+    true_name = "本当の名前.txt".encode("utf-8")
+    extra = (
+        struct.pack("<HHB", 0x7075, 5 + len(true_name), 1)
+        + struct.pack("<L", zlib.crc32(raw_name))
+        + true_name
+    )
+    with zipfile.ZipFile(input_zip, "w") as zf:
+        zf.writestr(cp932_info("ﾃｽﾄ.txt", extra), "abc")
+
+    stream_reencode_zip(input_zip, output_zip)
+
+    with zipfile.ZipFile(output_zip) as zf:
+        assert zf.namelist() == ["本当の名前.txt"]
+        assert zf.read("本当の名前.txt") == b"abc"
+        assert zf.infolist()[0].extra == extra
+
+
+def test_duplicate_names_leave_no_output(tmp_path):
+    input_zip = tmp_path / "input.zip"
+    output_zip = tmp_path / "output.zip"
+    with zipfile.ZipFile(input_zip, "w") as zf:
+        zf.writestr(cp932_info("表.txt"), "a")
+        zf.writestr(zipfile.ZipInfo("表.txt"), "b")
+
+    with pytest.raises(ValueError):
+        stream_reencode_zip(input_zip, output_zip)
+
+    assert list(tmp_path.iterdir()) == [input_zip]
@@ -0,0 +1,107 @@
+import json
+import zipfile
+from datetime import datetime
+
+from channel_index import parse_day_file
+from snapshots import MergedView, compact, list_compacted, list_merge_sources
+
+USERS = [{"id": "U1", "name": "alice", "real_name": "Alice"}]
+
+
+def message(text: str, day: int, hour: int = 12) -> dict:
+    ts = f"{datetime(2024, 1, day, hour).timestamp():.6f}"
+    return {"type": "message", "user": "U1", "text": text, "ts": ts}
+
+
+def write_zip(path, day_files: dict):
+    """日別ファイルの辞書 {"チャンネル/YYYY-MM-DD.json": 投稿のリスト} からZIPを作る"""
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("users.json", json.dumps(USERS))
+        for name, posts in day_files.items():
+            zf.writestr(name, json.dumps(posts))
+
+
+def merged_content(backup_path) -> dict:
+    """次のマージが読むZIPを重ねた内容（日別ファイルは投稿のリスト）"""
+    with MergedView(list_merge_sources(backup_path)) as view:
+        return {
+            name: view.messages(name) if parse_day_file(name) else view.read(name)
+            for name in view.names()
+        }
+
+
+def add_snapshots(backup_path, start: int, count: int):
+    """1日ずつ投稿が増え、前日の日別ファイルに返信が付くスナップショットを作る"""
+    for day in range(start, start + count):
+        write_zip(
+            backup_path / f"slackdump_202401{day:02d}_000000.zip",
+            {
+                f"general/2024-01-{day - 1:02d}.json": [
+                    message(f"post {day - 1}", day - 1),
+                    message(f"reply {day - 1}", day - 1, hour=18),
+                ],
+                f"general/2024-01-{day:02d}.json": [message(f"post {day}", day)],
+            },
+        )
+
+
+def test_fold_delta_and_rebase_keep_merged_content(tmp_path):
+    add_snapshots(tmp_path, 2, 4)
+
+    # ベースを作る
+    before = merged_content(tmp_path)
+    compact(tmp_path, keep=1, max_deltas=1)
+    base, deltas = list_compacted(tmp_path)
+    assert base is not None and deltas == []
+    assert len(list(tmp_path.glob("slackdump_*.zip"))) == 1
+    assert merged_content(tmp_path) == before
+
+    # 同じ秒のうちに差分を作っても、ベースの後に重ねられる
+    add_snapshots(tmp_path, 6, 2)
+    before = merged_content(tmp_path)
+    compact(tmp_path, keep=1, max_deltas=1)
+    current_base, deltas = list_compacted(tmp_path)
+    assert current_base == base and len(deltas) == 1
+    assert merged_content(tmp_path) == before
+
+    # 差分が多すぎるのでベースを作り直し、古いベースと差分を削除する
+    add_snapshots(tmp_path, 8, 2)
+    before = merged_content(tmp_path)
+    compact(tmp_path, keep=1, max_deltas=1)
+    new_base, new_deltas = list_compacted(tmp_path)
+    assert new_base != base and new_deltas == []
+    assert sorted(tmp_path.glob("*.zip")) == sorted(
+        [new_base, tmp_path / "slackdump_20240109_000000.zip"]
+    )
+    assert merged_content(tmp_path) == before
+
+
+def test_rebase_in_same_second_keeps_new_base(tmp_path):
+    add_snapshots(tmp_path, 2, 6)
+    before = merged_content(tmp_path)
+
+    # max_deltas=0 では毎回ベースを作り直す。続けて実行しても新しいベースは消えない
+    for keep in (4, 2, 1):
+        compact(tmp_path, keep=keep, max_deltas=0)
+        base, deltas = list_compacted(tmp_path)
+        assert base is not None and base.exists() and deltas == []
+        assert merged_content(tmp_path) == before
+    assert len(list(tmp_path.glob("base_*.zip"))) == 1
+
+
+def test_delta_with_same_timestamp_as_base_is_merged(tmp_path):
+    # 秒単位の名前だった頃に、ベースと同じ秒に作られた差分
+    write_zip(
+        tmp_path / "base_20240101_000000.zip",
+        {"general/2024-01-01.json": [message("a", 1)]},
+    )
+    write_zip(
+        tmp_path / "delta_20240101_000000.zip",
+        {"general/2024-01-01.json": [message("b", 1, 18)]},
+    )
+
+    base, deltas = list_compacted(tmp_path)
+    assert base == tmp_path / "base_20240101_000000.zip"
+    assert deltas == [tmp_path / "delta_20240101_000000.zip"]
+    texts = [post["text"] for post in merged_content(tmp_path)["general/2024-01-01.json"]]
+    assert texts == ["a", "b"]
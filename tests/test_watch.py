@@ -0,0 +1,185 @@
+import argparse
+import json
+import zipfile
+from datetime import datetime
+
+from watch import SnapshotWatcher
+
+USERS = [
+    {"id": "U1", "name": "alice", "real_name": "Alice", "profile": {"display_name": "Alice"}},
+    {"id": "U2", "name": "bob", "real_name": "Bob", "profile": {"display_name": "Bob"}},
+]
+
+
+def ts(day: int, hour: int = 12) -> str:
+    return f"{datetime(2024, 1, day, hour).timestamp():.6f}"
+
+
+def message(user: str, text: str, day: int, hour: int = 12, thread_day=None) -> dict:
+    post = {"type": "message", "user": user, "text": text, "ts": ts(day, hour)}
+    if thread_day is not None:
+        post["thread_ts"] = ts(thread_day)
+    return post
+
+
+def write_snapshot(backup_path, timestamp: str, day_files: dict):
+    """日別ファイルの辞書 {"チャンネル/YYYY-MM-DD.json": 投稿のリスト} からスナップショットを作る"""
+    with zipfile.ZipFile(backup_path / f"slackdump_{timestamp}.zip", "w") as zf:
+        zf.writestr("users.json", json.dumps(USERS))
+        for name, posts in day_files.items():
+            zf.writestr(name, json.dumps(posts))
+
+
+def make_watcher(tmp_path, skip_analyze: bool = True):
+    backup_path = tmp_path / "backups" / "default"
+    backup_path.mkdir(parents=True)
+    args = argparse.Namespace(
+        compact_text=False,
+        since=None,
+        until=None,
+        skip_analyze=skip_analyze,
+        max_size=100_0000,
+        size_metric="characters",
+    )
+    return backup_path, SnapshotWatcher(backup_path, tmp_path / "work", args)
+
+
+def read_text(watcher, channel: str) -> str:
+    return (watcher.txt_dir / f"{channel}.html.txt").read_text(encoding="utf-8")
+
+
+def test_first_poll_converts_all_channels(tmp_path):
+    backup_path, watcher = make_watcher(tmp_path)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {
+            "general/2024-01-01.json": [message("U1", "hello general", 1)],
+            "random/2024-01-01.json": [message("U2", "hello random", 1)],
+        },
+    )
+
+    assert watcher.poll() == {"general", "random"}
+    assert "hello general" in read_text(watcher, "general")
+    assert "hello random" in read_text(watcher, "random")
+    # 変化がなければ何もしない
+    assert watcher.poll() == set()
+
+
+def test_late_reply_in_existing_day_file_is_picked_up(tmp_path):
+    backup_path, watcher = make_watcher(tmp_path)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {"general/2024-01-01.json": [message("U1", "question", 1, thread_day=1)]},
+    )
+    watcher.poll()
+
+    # 新しいスナップショットでは、同じ日別ファイルに後から付いた返信が増えている
+    write_snapshot(
+        backup_path,
+        "20240102_000000",
+        {
+            "general/2024-01-01.json": [
+                message("U1", "question", 1, thread_day=1),
+                message("U2", "late reply", 1, hour=18, thread_day=1),
+            ]
+        },
+    )
+
+    assert watcher.poll() == {"general"}
+    text = read_text(watcher, "general")
+    assert "question" in text
+    assert "late reply" in text
+
+
+def test_old_messages_are_kept_when_newer_snapshot_drops_them(tmp_path):
+    backup_path, watcher = make_watcher(tmp_path)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {"general/2024-01-01.json": [message("U1", "old message", 1)]},
+    )
+    watcher.poll()
+    write_snapshot(
+        backup_path,
+        "20240102_000000",
+        {"general/2024-01-01.json": [message("U2", "new message", 1, hour=18)]},
+    )
+
+    assert watcher.poll() == {"general"}
+    text = read_text(watcher, "general")
+    assert "old message" in text
+    assert "new message" in text
+
+
+def test_unaffected_channel_text_is_not_rewritten(tmp_path):
+    backup_path, watcher = make_watcher(tmp_path)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {
+            "general/2024-01-01.json": [message("U1", "hello general", 1)],
+            "random/2024-01-01.json": [message("U2", "hello random", 1)],
+        },
+    )
+    watcher.poll()
+    random_text = watcher.txt_dir / "random.html.txt"
+    before = random_text.stat().st_mtime_ns
+
+    write_snapshot(
+        backup_path,
+        "20240102_000000",
+        {"general/2024-01-02.json": [message("U1", "next day", 2)]},
+    )
+
+    assert watcher.poll() == {"general"}
+    assert "next day" in read_text(watcher, "general")
+    assert random_text.stat().st_mtime_ns == before
+
+
+def test_partitioned_output_is_rebuilt_from_channel_texts(tmp_path):
+    backup_path, watcher = make_watcher(tmp_path, skip_analyze=False)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {"general/2024-01-01.json": [message("U1", "hello general", 1)]},
+    )
+    watcher.poll()
+    write_snapshot(
+        backup_path,
+        "20240102_000000",
+        {"random/2024-01-02.json": [message("U2", "hello random", 2)]},
+    )
+
+    assert watcher.poll() == {"random"}
+    output = "".join(
+        path.read_text(encoding="utf-8") for path in watcher.txt_dir.glob("*.txt")
+    )
+    assert "hello general" in output
+    assert "hello random" in output
+
+
+def test_corrupt_snapshot_is_skipped(tmp_path, capsys):
+    backup_path, watcher = make_watcher(tmp_path)
+    write_snapshot(
+        backup_path,
+        "20240101_000000",
+        {"general/2024-01-01.json": [message("U1", "hello general", 1)]},
+    )
+    (backup_path / "slackdump_20240102_000000.zip").write_bytes(b"truncated")
+
+    # 壊れたZIPがあっても、ほかのスナップショットは処理する
+    assert watcher.poll() == {"general"}
+    assert "hello general" in read_text(watcher, "general")
+    assert watcher.poll() == set()
+    assert capsys.readouterr().out.count("slackdump_20240102_000000.zip") == 1
+
+    # 置き換えられたら読む
+    write_snapshot(
+        backup_path,
+        "20240102_000000",
+        {"random/2024-01-02.json": [message("U2", "hello random", 2)]},
+    )
+    assert watcher.poll() == {"random"}
+    assert "hello random" in read_text(watcher, "random")
@@ -0,0 +1,253 @@
+import shutil
+import time
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+
+from channel_index import parse_day_file
+from dump2html import SlackJsonToHtml
+from mod_text import (
+    analyze_consolidate_and_clean_files,
+    is_blacklisted,
+    make_partitioner,
+    process_html_file,
+)
+from snapshots import MergedView, list_merge_sources
+from ziputil import safe_member_path
+
+
+class LRUCache(OrderedDict):
+    """最近使ったものから maxsize 個だけ保持する辞書"""
+
+    def __init__(self, maxsize: int = 256):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def get(self, key, default=None):
+        if key not in self:
+            return default
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+class SnapshotWatcher:
+    """backups/<バックアップID>/ を監視し、新しいスナップショットで変わったチャンネルだけを処理するクラス
+
+    ユーザ一覧、ZIPごとのメンバー一覧、日別ファイルの投稿をメモリに保持したまま poll() を繰り返す。
+    """
+
+    def __init__(self, backup_path, work_path, args, cache_size: int = 256):
+        """
+        Args:
+            backup_path: 監視するバックアップディレクトリ
+            work_path: 作業ディレクトリ（slackdump, html, txt を作る）
+            args: backup.py のコマンドライン引数
+            cache_size: 覚えておく日別ファイルの数
+        """
+        self.backup_path = Path(backup_path)
+        self.work_path = Path(work_path)
+        self.dump_dir = self.work_path / "slackdump"
+        self.html_dir = self.work_path / "html"
+        self.txt_dir = self.work_path / "txt"
+        # 分割・結合は入力を消すので、チャンネルごとのテキストは別の場所に残しておく
+        if args.skip_analyze:
+            self.text_dir = self.txt_dir
+        else:
+            self.text_dir = self.work_path / "channel_txt"
+        for path in (self.dump_dir, self.html_dir, self.txt_dir, self.text_dir):
+            path.mkdir(parents=True, exist_ok=True)
+        self.args = args
+
+        self.sources = {}  # ZIPのパス -> (サイズ, 更新時刻)
+        self.members = {}  # ZIPのパス -> {メンバー名: CRC}
+        self.signatures = {}  # メンバー名 -> マージ結果を決める CRC（_signatures を参照）
+        self.bad_sources = {}  # 読めなかったZIPのパス -> そのときの (サイズ, 更新時刻)
+        self.day_cache = LRUCache(cache_size)
+        self.converter = None
+        # チャンネルごとのテキストのファイル名 -> FilePartitioner.measure_text の結果
+        self.text_sizes = {}
+
+    def _skip_source(self, zip_path, signature, reason):
+        # 壊れたZIPは読まずに残りで続ける。同じ状態のままなら何度も表示しない
+        if self.bad_sources.get(zip_path) != signature:
+            print(f"[watch] 読めないZIPをスキップします: {zip_path} ({reason})")
+        self.bad_sources[zip_path] = signature
+
+    def _scan(self):
+        # マージと同じ順番（古い順）でZIPを並べる
+        sources = {}
+        for zip_path in list_merge_sources(self.backup_path):
+            stat = zip_path.stat()
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if not zipfile.is_zipfile(zip_path):
+                # 直されたり置き換えられたりすれば、サイズか更新時刻が変わるので次の poll で読む
+                self._skip_source(zip_path, signature, "ZIPファイルではありません")
+                continue
+            self.bad_sources.pop(zip_path, None)
+            sources[zip_path] = signature
+        return sources
+
+    def _read_members(self, sources):
+        members = {}
+        for zip_path, signature in sources.items():
+            if self.sources.get(zip_path) == signature and zip_path in self.members:
+                members[zip_path] = self.members[zip_path]
+                continue
+            try:
+                with zipfile.ZipFile(zip_path) as zf:
+                    members[zip_path] = {
+                        info.filename: info.CRC
+                        for info in zf.infolist()
+                        if not info.is_dir()
+                    }
+            except zipfile.BadZipFile as e:
+                self._skip_source(zip_path, signature, e)
+        return members
+
+    @staticmethod
+    def _signatures(sources, members):
+        # マージ結果が同じなら同じになる値を、メンバーごとに求める
+        # - 日別ファイルは各ZIPの投稿をまとめるので、マージする順の CRC の並び
+        #   （同じ内容が続いてもマージ結果は変わらないので、連続する同じ CRC はまとめる）
+        # - それ以外のファイルは最後のZIPのものを使うので、その CRC
+        signatures = {}
+        for zip_path in sources:
+            for name, crc in members[zip_path].items():
+                if parse_day_file(name) is None:
+                    signatures[name] = crc
+                    continue
+                crcs = signatures.get(name, ())
+                if not crcs or crcs[-1] != crc:
+                    signatures[name] = crcs + (crc,)
+        return signatures
+
+    def poll(self):
+        """スナップショットの変化を調べて処理し、変わったチャンネルの集合を返す"""
+        sources = self._scan()
+        if sources == self.sources:
+            return set()
+
+        members = self._read_members(sources)
+        sources = {zip_path: sources[zip_path] for zip_path in members}
+        signatures = self._signatures(sources, members)
+        changed = {
+            name
+            for name in signatures.keys() | self.signatures.keys()
+            if signatures.get(name) != self.signatures.get(name)
+        }
+        if not changed:
+            self.sources, self.members = sources, members
+            return set()
+
+        # 変わったメンバーだけを merge_zip_files と同じ規則でまとめ直して書き出す
+        with MergedView(list(sources)) as view:
+            for name in sorted(changed):
+                target_path = safe_member_path(self.dump_dir, name)
+                if name in signatures:
+                    target_path.parent.mkdir(parents=True, exist_ok=True)
+                    target_path.write_bytes(view.read(name))
+                else:
+                    target_path.unlink(missing_ok=True)
+
+        channels = {
+            parse_day_file(name)[0] for name in signatures if parse_day_file(name)
+        }
+        if self.converter is None or "users.json" in changed:
+            # ユーザ名が変わるとすべてのチャンネルの表示が変わる
+            self._load_converter()
+            affected = set(channels)
+        else:
+            affected = {
+                parse_day_file(name)[0] for name in changed if parse_day_file(name)
+            }
+        affected = {channel for channel in affected if not is_blacklisted(channel)}
+
+        for channel in sorted(affected):
+            if channel in channels:
+                print(f"[watch] {channel} を変換中...")
+                self.converter.dump_channel(channel)
+            else:
+                (self.html_dir / f"{channel}.html").unlink(missing_ok=True)
+                shutil.rmtree(self.dump_dir / channel, ignore_errors=True)
+        if affected:
+            if self.args.compact_text:
+                self.converter.report_savings()
+            self.publish(affected)
+        self.sources, self.members, self.signatures = sources, members, signatures
+        return affected
+
+    def _load_converter(self):
+        if self.converter is None:
+            self.converter = SlackJsonToHtml(
+                self.dump_dir,
+                str(self.html_dir),
+                [],
+                compact=self.args.compact_text,
+                since=self.args.since,
+                until=self.args.until,
+                day_cache=self.day_cache,
+            )
+        else:
+            self.converter.load_users()
+
+    def publish(self, affected):
+        """変わったチャンネルのテキストだけを作り直し、txt ディレクトリを更新する"""
+        sizer = make_partitioner(
+            self.text_dir, threshold=self.args.max_size, metric=self.args.size_metric
+        )
+        for channel in sorted(affected):
+            html_path = self.html_dir / f"{channel}.html"
+            text_path = self.text_dir / f"{channel}.html.txt"
+            if html_path.exists():
+                content = process_html_file(html_path, text_path)
+                self.text_sizes[text_path.name] = sizer.measure_text(content)
+            else:
+                text_path.unlink(missing_ok=True)
+                self.text_sizes.pop(text_path.name, None)
+
+        if self.args.skip_analyze:
+            return
+
+        # 分割・結合した txt は、残しておいたチャンネルごとのテキストから作り直す
+        for file_path in self.txt_dir.glob("*.txt"):
+            file_path.unlink()
+        partitioner = make_partitioner(
+            self.txt_dir, threshold=self.args.max_size, metric=self.args.size_metric
+        )
+        for text_path in self.text_dir.glob("*.txt"):
+            file_path = self.txt_dir / text_path.name
+            shutil.copyfile(text_path, file_path)
+            if text_path.name in self.text_sizes:
+                partitioner.remember(file_path, *self.text_sizes[text_path.name])
+        analyze_consolidate_and_clean_files(
+            self.txt_dir,
+            threshold=self.args.max_size,
+            chart_path=self.work_path / "file_sizes_chart.png",
+            metric=self.args.size_metric,
+            partitioner=partitioner,
+        )
+
+
+def watch(watchers: dict, interval: float = 60):
+    """Ctrl+C で止めるまで、一定間隔ですべてのバックアップIDを監視する"""
+    print(f"{', '.join(watchers)} を監視しています (Ctrl+C で終了)")
+    try:
+        while True:
+            for backup_id, watcher in watchers.items():
+                try:
+                    affected = watcher.poll()
+                except Exception as e:
+                    # 失敗したスナップショットは次の poll でもう一度処理する
+                    print(f"[{backup_id}] エラーが発生しました: {e}")
+                    continue
+                if affected:
+                    print(f"[{backup_id}] {len(affected)} チャンネルを更新しました")
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        print("監視を終了しました")
@@ -0,0 +1,130 @@
+import bz2
+import zipfile
+import zlib
+from collections import deque
+from pathlib import Path
+
+ZIP_CODECS = {
+    "stored": zipfile.ZIP_STORED,
+    "deflated": zipfile.ZIP_DEFLATED,
+    "bzip2": zipfile.ZIP_BZIP2,
+    "lzma": zipfile.ZIP_LZMA,
+}
+
+# 圧縮方式ごとに指定できる圧縮レベルの範囲（None はレベルを指定できない）
+LEVEL_RANGES = {
+    zipfile.ZIP_STORED: None,
+    zipfile.ZIP_DEFLATED: (0, 9),
+    zipfile.ZIP_BZIP2: (1, 9),
+    zipfile.ZIP_LZMA: None,  # zipfile の LZMA は常に既定のプリセットで圧縮する
+}
+
+# LZMA の圧縮データの終わりに EOS マーカーがあることを示すフラグ (ZipFile と同じく立てる)
+FLAG_LZMA_EOS = 0x02
+
+# zipfile には圧縮済みのデータをそのまま書き込む公開APIがないため、write_raw_member は
+# ZipFile.write と同じ手順で内部の属性を直接更新する。CPython 3.11〜3.13 の zipfile で確認済み
+_RAW_WRITE_ATTRS = ("fp", "filelist", "NameToInfo", "start_dir")
+
+
+def check_compresslevel(compression: int, compresslevel: int | None):
+    """圧縮方式に使えない圧縮レベルなら ValueError を送出"""
+    if compresslevel is None:
+        return
+    level_range = LEVEL_RANGES[compression]
+    if level_range is None:
+        raise ValueError("この圧縮方式では圧縮レベルを指定できません")
+    low, high = level_range
+    if not low <= compresslevel <= high:
+        raise ValueError(f"圧縮レベルは {low}〜{high} で指定してください")
+
+
+def safe_member_path(dest_dir, member: str) -> Path:
+    """メンバーの展開先を返す。展開先の外を指す名前（../ や絶対パス）は ValueError"""
+    dest_dir = Path(dest_dir).resolve()
+    target_path = (dest_dir / member).resolve()
+    if not target_path.is_relative_to(dest_dir):
+        raise ValueError(f"展開先の外を指すメンバーです: {member}")
+    return target_path
+
+
+def prefetch(executor, func, items, window: int = 64):
+    """items の各要素に func をスレッドプールで先行して適用し、(要素, 結果) を順番に返す
+
+    メモリを抑えるため、先行させる要素は window 個までに制限する。
+    """
+    pending = deque()
+    for item in items:
+        pending.append((item, executor.submit(func, item)))
+        if len(pending) >= window:
+            item, future = pending.popleft()
+            yield item, future.result()
+    while pending:
+        item, future = pending.popleft()
+        yield item, future.result()
+
+
+def compress_bytes(data: bytes, compression: int, compresslevel: int | None = None):
+    """ZIPのメンバーとしてそのまま書き込める圧縮データを返す
+
+    zlib・bz2・lzma は圧縮中に GIL を解放するので、スレッドごとに並列で圧縮できる。
+    """
+    if compression == zipfile.ZIP_STORED:
+        return data
+    if compression == zipfile.ZIP_DEFLATED:
+        if compresslevel is None:
+            compresslevel = zlib.Z_DEFAULT_COMPRESSION
+        compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    elif compression == zipfile.ZIP_BZIP2:
+        compressor = bz2.BZ2Compressor(compresslevel or 9)
+    elif compression == zipfile.ZIP_LZMA:
+        # ZIPの LZMA はバージョンとプロパティのヘッダが付くので zipfile の実装を使う
+        compressor = zipfile.LZMACompressor()
+    else:
+        raise ValueError(f"未対応の圧縮方式です: {compression}")
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_file(file_path, arc_name: str, compression: int, compresslevel=None):
+    """ファイルを読み込んで圧縮し、(ZipInfo, 圧縮データ) を返す"""
+    data = Path(file_path).read_bytes()
+    zinfo = zipfile.ZipInfo.from_file(file_path, arc_name)
+    zinfo.compress_type = compression
+    zinfo.file_size = len(data)
+    zinfo.CRC = zlib.crc32(data)
+    compressed = compress_bytes(data, compression, compresslevel)
+    zinfo.compress_size = len(compressed)
+    if compression == zipfile.ZIP_LZMA:
+        zinfo.flag_bits |= FLAG_LZMA_EOS
+    return zinfo, compressed
+
+
+def write_raw_member(zf: zipfile.ZipFile, zinfo: zipfile.ZipInfo, chunks):
+    """圧縮済みのデータを1メンバーとして書き込む
+
+    zinfo には CRC・圧縮前後のサイズ・圧縮方式を設定しておく。同じ名前のメンバーがすでにあれば
+    ValueError を送出する（ZipFile.write は警告を出すだけで重複したエントリを書いてしまう）。
+    """
+    missing = [name for name in _RAW_WRITE_ATTRS if not hasattr(zf, name)]
+    if missing:
+        raise RuntimeError(
+            f"この Python の zipfile には対応していません（{', '.join(missing)} がありません）"
+        )
+    if zf.mode not in ("w", "x", "a"):
+        raise ValueError("書き込みモードで開いたZIPファイルを指定してください")
+    if zinfo.filename in zf.NameToInfo:
+        raise ValueError(f"同じ名前のメンバーがすでにあります: {zinfo.filename}")
+
+    zf.fp.seek(zf.start_dir)
+    zinfo.header_offset = zf.fp.tell()
+    zf.fp.write(zinfo.FileHeader())
+    written = 0
+    for chunk in chunks:
+        zf.fp.write(chunk)
+        written += len(chunk)
+    if written != zinfo.compress_size:
+        raise ValueError(f"圧縮データのサイズが一致しません: {zinfo.filename}")
+
+    zf.filelist.append(zinfo)
+    zf.NameToInfo[zinfo.filename] = zinfo
+    zf.start_dir = zf.fp.tell()